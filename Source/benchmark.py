@@ -0,0 +1,325 @@
+import argparse
+import json
+import math
+import random
+import time
+import tracemalloc
+from collections import Counter
+from text_wave_handler import TextWaveHandler
+
+#Characters synthetic corpora are drawn from, in order, so small alphabets stay readable
+ALPHABET = "abcdefghijklmnopqrstuvwxyz" + "".join(chr(c) for c in range(0x3b1, 0x3ca)) + "".join(chr(c) for c in range(0x430, 0x450))
+
+def synthetic_corpus(alphabet_size, lines, order = 2, concentration = 0.5, min_length = 4, max_length = 12, seed = 0):
+    """Generates lines from a random Markov chain, so the structure of the corpus is controlled.
+
+    Every context of order characters gets its own distribution over the next character, drawn
+    from a symmetric Dirichlet distribution. A low concentration gives peaked distributions and
+    a low entropy corpus, a high concentration gives nearly uniform ones.
+
+    Parameters
+    ----------
+    alphabet_size : int
+        The number of distinct characters, at most len(ALPHABET)
+    lines : int
+        The number of lines to generate
+    order : int, optional
+        The number of previous characters each character depends on
+    concentration : float, optional
+        The parameter of the Dirichlet distribution of each context
+    min_length : int, optional
+        The shortest length of a line
+    max_length : int, optional
+        The longest length of a line
+    seed : int, optional
+        The seed of the random generator
+
+    Returns
+    -------
+    list <str>
+        The lines generated
+    """
+
+    if alphabet_size > len(ALPHABET):
+        raise Exception("The alphabet size can be at most " + str(len(ALPHABET)))
+    rng = random.Random(seed)
+    alphabet = ALPHABET[:alphabet_size]
+    contexts = {}
+    out = []
+    for _ in range(lines):
+        line = ""
+        for _ in range(rng.randint(min_length, max_length)):
+            context = line[-order:] if order > 0 else ""
+            if context not in contexts:
+                weights = [rng.gammavariate(concentration, 1) for _ in alphabet]
+                contexts[context] = weights
+            line = line + rng.choices(alphabet, contexts[context])[0]
+        out.append(line)
+    return out
+
+def ngram_entropy(lines, n):
+    """Finds the entropy in bits of the next character given the previous n-1 characters.
+
+    Parameters
+    ----------
+    lines : list <str>
+    n : int
+        The length of the n-grams, at least 1
+
+    Returns
+    -------
+    float
+        The conditional entropy of the corpus
+    """
+
+    grams = Counter()
+    contexts = Counter()
+    for line in lines:
+        for i in range(len(line)):
+            gram = line[max(0, i - n + 1):i + 1]
+            grams[gram] = grams[gram] + 1
+            contexts[gram[:-1]] = contexts[gram[:-1]] + 1
+    total = sum(grams.values())
+    return -sum(count*math.log2(count/contexts[gram[:-1]]) for gram, count in grams.items())/total
+
+def chi_square(first, second):
+    """Tests if two samples of categories come from the same distribution.
+
+    The p-value uses the Wilson-Hilferty approximation of the chi-square distribution.
+
+    Parameters
+    ----------
+    first : Counter
+    second : Counter
+
+    Returns
+    -------
+    tuple <float>
+        The chi-square statistic, its p-value and the total variation distance of the samples
+    """
+
+    n1 = sum(first.values())
+    n2 = sum(second.values())
+    if n1 == 0 or n2 == 0:
+        return 0.0, 1.0, 0.0
+    statistic = 0.0
+    variation = 0.0
+    categories = set(first) | set(second)
+    for c in categories:
+        total = first[c] + second[c]
+        e1 = total*n1/(n1 + n2)
+        e2 = total*n2/(n1 + n2)
+        statistic = statistic + (first[c] - e1)**2/e1 + (second[c] - e2)**2/e2
+        variation = variation + abs(first[c]/n1 - second[c]/n2)
+    k = len(categories) - 1
+    if k < 1:
+        return statistic, 1.0, variation/2
+    z = ((statistic/k)**(1/3) - (1 - 2/(9*k)))/math.sqrt(2/(9*k))
+    return statistic, 0.5*math.erfc(z/math.sqrt(2)), variation/2
+
+def bench_setting(lines, radius, max_size, attempts = 200, produced = 100, seed = 0, **options):
+    """Measures every phase of generation for one model and size of Wave.
+
+    Parameters
+    ----------
+    lines : list <str>
+        The corpus
+    radius : int
+    max_size : int
+    attempts : int, optional
+        The number of Waves to populate and collapse
+    produced : int, optional
+        The number of strings to produce
+    seed : int, optional
+        The seed of the random generator
+    **options
+        Other arguments of TextWaveHandler
+
+    Returns
+    -------
+    dict
+        The measurements of the setting
+    """
+
+    wh = TextWaveHandler(max_size=max_size, radius=radius, rng=random.Random(seed), **options)
+    start = time.perf_counter()
+    wh.read_lines(lines)
+    ingest = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wh.generate_wave()
+    compile_time = time.perf_counter() - start
+
+    populate = 0.0
+    collapse = 0.0
+    failures = 0
+    for _ in range(attempts):
+        start = time.perf_counter()
+        wh.generate_wave()
+        populate = populate + time.perf_counter() - start
+        start = time.perf_counter()
+        if not wh.wave.collapse():
+            failures = failures + 1
+        collapse = collapse + time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = wh.produce_batch(produced)
+    produce = time.perf_counter() - start
+    peak = peak_memory(lines, radius, max_size, produced, seed, **options)
+
+    accepted = len([r for r in results if r.text is not None])
+    total_attempts = sum(r.attempts for r in results)
+    return {"radius" : radius, "max_size" : max_size, "patches" : len(wh.patches_list),
+            "ingest_s" : ingest, "compile_s" : compile_time,
+            "populate_ms" : 1000*populate/attempts, "collapse_ms" : 1000*collapse/attempts,
+            "failure_rate" : failures/attempts, "accepted_per_s" : accepted/produce if produce > 0 else 0.0,
+            "produce_failure_rate" : 1 - accepted/total_attempts if total_attempts else 0.0,
+            "peak_mb" : peak/(1 << 20)}
+
+def peak_memory(lines, radius, max_size, produced = 100, seed = 0, **options):
+    """Measures the peak memory of reading a corpus and producing strings from it.
+
+    Tracing every allocation slows Python down several times, so this is a separate pass
+    from the timed one in bench_setting.
+
+    Parameters
+    ----------
+    lines : list <str>
+        The corpus
+    radius : int
+    max_size : int
+    produced : int, optional
+        The number of strings to produce
+    seed : int, optional
+        The seed of the random generator
+    **options
+        Other arguments of TextWaveHandler
+
+    Returns
+    -------
+    int
+        The peak of the traced memory, in bytes
+    """
+
+    tracemalloc.start()
+    try:
+        wh = TextWaveHandler(max_size=max_size, radius=radius, rng=random.Random(seed), **options)
+        wh.read_lines(lines)
+        wh.generate_wave()
+        wh.produce_batch(produced)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def compare_engines(lines, radius, max_size, engines = ("wave", "batch"), n = 500, seed = 0, **options):
+    """Compares the distribution of strings produced by each engine to that of the first one.
+
+    The lengths, and the characters pooled over every position, are compared with a chi-square test.
+    The "wave" and "batch" engines collapse Waves the same way and should match. The
+    "automaton" engine samples every string the model accepts in proportion to its
+    frequencies, without failed attempts, so it is expected to differ from them.
+
+    Parameters
+    ----------
+    lines : list <str>
+        The corpus
+    radius : int
+    max_size : int
+    engines : iterable <str>, optional
+        The engines to compare, the first one being the reference
+    n : int, optional
+        The number of strings to produce with each engine
+    seed : int, optional
+        The seed of the random generators
+    **options
+        Other arguments of TextWaveHandler
+
+    Returns
+    -------
+    list <dict>
+        The comparison of each other engine with the reference
+    """
+
+    samples = {}
+    for engine in engines:
+        wh = TextWaveHandler(max_size=max_size, radius=radius, rng=random.Random(seed), engine=engine, **options)
+        wh.read_lines(lines)
+        samples[engine] = [r.text for r in wh.produce_batch(n) if r.text is not None]
+
+    reference = engines[0]
+    out = []
+    for engine in engines[1:]:
+        row = {"reference" : reference, "engine" : engine}
+        for name, key in (("length", len), ("characters", None)):
+            if key is None:
+                first = Counter(c for text in samples[reference] for c in text)
+                second = Counter(c for text in samples[engine] for c in text)
+            else:
+                first = Counter(key(text) for text in samples[reference])
+                second = Counter(key(text) for text in samples[engine])
+            statistic, p, variation = chi_square(first, second)
+            row[name + "_chi2"] = statistic
+            row[name + "_p"] = p
+            row[name + "_tv"] = variation
+        out.append(row)
+    return out
+
+def print_table(rows):
+    """Prints a list of measurements as an aligned table."""
+
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[("%.4g" % row[c]) if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(r, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the string wave collapse on synthetic corpora.")
+    parser.add_argument("--alphabet", type=int, nargs="+", default=[8, 26])
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--order", type=int, default=2)
+    parser.add_argument("--concentration", type=float, default=0.5)
+    parser.add_argument("--radius", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--max-size", type=int, nargs="+", default=[12, 24, 40])
+    parser.add_argument("--attempts", type=int, default=100)
+    parser.add_argument("--produced", type=int, default=50)
+    parser.add_argument("--compare", type=int, default=500, help="strings per engine in the engine comparison, 0 to skip")
+    parser.add_argument("--engines", nargs="+", default=["wave", "batch"],
+                        help="engines to compare, the first being the reference; batch needs numpy, and automaton is expected to differ")
+    parser.add_argument("--corpus", help="a text file to use instead of synthetic corpora")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="a file to write every measurement to")
+    args = parser.parse_args()
+
+    if args.corpus is not None:
+        with open(args.corpus, "r") as f:
+            corpora = {args.corpus : f.read().split("\n")}
+    else:
+        corpora = {}
+        for size in args.alphabet:
+            name = "alphabet=%d" % size
+            corpora[name] = synthetic_corpus(size, args.lines, args.order, args.concentration,
+                                             max_length=max(args.max_size), seed=args.seed)
+
+    report = []
+    for name, lines in corpora.items():
+        print("%s : %d lines, %.3f bits per character" % (name, len(lines), ngram_entropy(lines, args.order + 1)))
+        rows = [bench_setting(lines, r, s, args.attempts, args.produced, args.seed)
+                for r in args.radius for s in args.max_size]
+        print_table(rows)
+        comparisons = []
+        if args.compare > 0:
+            comparisons = compare_engines(lines, args.radius[0], args.max_size[0], args.engines, args.compare, args.seed)
+            print_table(comparisons)
+        print()
+        report.append({"corpus" : name, "settings" : rows, "engines" : comparisons})
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import math
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#A Mersenne prime larger than any hash, for the hash family of the rows
+PRIME = (1 << 61) - 1
+
+class CountMinSketch:
+    """Approximate counts of many keys in a fixed amount of memory.
+
+    Each key adds its count to one counter of every row, and its estimate is the smallest of
+    those counters, so an estimate is never lower than the true count. With a width of
+    e/epsilon and a depth of ln(1/delta), an estimate exceeds the true count by more than
+    epsilon times the total count with a probability of at most delta.
+
+    Keys are hashed with blake2b rather than the built-in hash, which is salted in every process,
+    so that sketches of the shards of a corpus made in different processes can be merged.
+
+    Attributes
+    ----------
+    width : int
+        The number of counters in each row
+    depth : int
+        The number of rows
+    rows : list <array>
+        The counters of each row
+    seeds : list <tuple>
+        The (a, b) of the hash (a*digest(key) + b) % PRIME % width of each row
+    total : int
+        The sum of every count added
+    """
+
+    def __init__(self, width = 1 << 20, depth = 4):
+        """
+        Parameters
+        ----------
+        width : int, optional
+        depth : int, optional
+        """
+
+        self.width = width
+        self.depth = depth
+        self.rows = [array("Q", bytes(8*width)) for i in range(depth)]
+        self.seeds = [(2*i + 1, 7919*i + 12345) for i in range(1, depth + 1)]
+        self.total = 0
+
+    @classmethod
+    def from_error(cls, epsilon, delta):
+        """Builds a sketch sized for an error bound.
+
+        Parameters
+        ----------
+        epsilon : float
+            The largest overestimate, as a fraction of the total count
+        delta : float
+            The probability of exceeding it
+
+        Returns
+        -------
+        CountMinSketch
+        """
+
+        return cls(int(math.ceil(math.e/epsilon)), int(math.ceil(math.log(1/delta))))
+
+    def add(self, key, count = 1):
+        """Adds to the count of one key.
+
+        Parameters
+        ----------
+        key : hashable
+        count : int, optional
+        """
+
+        h = digest(key)
+        width = self.width
+        for row, (a, b) in zip(self.rows, self.seeds):
+            row[(a*h + b) % PRIME % width] += count
+        self.total = self.total + count
+
+    def update(self, counts):
+        """Adds the counts of many keys.
+
+        Parameters
+        ----------
+        counts : dict {<hashable> : int}
+        """
+
+        for key, count in counts.items():
+            self.add(key, count)
+
+    def estimate(self, key):
+        """Estimates the count of one key, never below its true count.
+
+        Parameters
+        ----------
+        key : hashable
+
+        Returns
+        -------
+        int
+            The estimate
+        """
+
+        h = digest(key)
+        width = self.width
+        return min(row[(a*h + b) % PRIME % width] for row, (a, b) in zip(self.rows, self.seeds))
+
+    def merge(self, other):
+        """Adds the counts of another sketch, such as one of another shard of the corpus, to this one.
+
+        Parameters
+        ----------
+        other : CountMinSketch
+            A sketch with the same width and depth
+
+        Returns
+        -------
+        CountMinSketch
+            This sketch, so that merges can be chained or reduced
+        """
+
+        if (other.width, other.depth, other.seeds) != (self.width, self.depth, self.seeds):
+            raise Exception("Cannot merge sketches of a different width or depth")
+        for row, other_row in zip(self.rows, other.rows):
+            if np is not None:
+                counters = np.frombuffer(row, dtype=np.uint64)
+                counters += np.frombuffer(other_row, dtype=np.uint64)
+            else:
+                for i, count in enumerate(other_row):
+                    if count:
+                        row[i] = row[i] + count
+        self.total = self.total + other.total
+        return self
+
+    def memory(self):
+        """Finds the bytes used by the counters.
+
+        Returns
+        -------
+        int
+        """
+
+        return sum(row.itemsize*len(row) for row in self.rows)
+
+def digest(key):
+    """Hashes a key the same way in every process.
+
+    Parameters
+    ----------
+    key : str or tuple <str>
+        A sub-string, or the phonemes of one
+
+    Returns
+    -------
+    int
+        A 64-bit hash of the key
+    """
+
+    if isinstance(key, tuple):
+        key = "\x1f".join(key)
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
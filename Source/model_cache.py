@@ -0,0 +1,247 @@
+import collections
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+
+def hash_text(text):
+    """Hashes the content of a corpus.
+
+    Parameters
+    ----------
+    text : str, bytes or memoryview
+        The corpus
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 digest of the corpus, encoded as UTF-8 if it is a str
+    """
+
+    if isinstance(text, str):
+        text = text.encode("utf-8", "surrogatepass")
+    return hashlib.sha256(text).hexdigest()
+
+def hash_file(path, chunk_size = 1 << 20):
+    """Hashes the content of a corpus file, reading it in chunks.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    chunk_size : int, optional
+        How many bytes to read at a time
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 digest of the file
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(chunk_size)
+    return digest.hexdigest()
+
+class ModelCache:
+    """Cache of the counts of corpora, in memory and optionally in a directory.
+
+    Counts are found by a base key, the hash of a corpus and of every parameter of the counts
+    but the radius, and by their radius. The PatchIndex built from them can be cached with them,
+    as building it costs more than counting. When the radius asked for is missing, the counts of
+    the lowest higher radius are used to derive it, unless they were sketched.
+
+    Attributes
+    ----------
+    directory : str
+        The directory of the cached counts, or None to only cache in memory
+    max_items : int
+        The number of counts kept in memory
+    max_bytes : int
+        The size the directory is kept under, by removing the least recently used counts
+    memory : collections.OrderedDict {<tuple> : tuple (PartialCounts, PatchIndex)}
+        The counts and PatchIndex in memory by base key and radius, from least to most recently used
+    hits : int
+        The number of counts found
+    misses : int
+        The number of counts not found
+    """
+
+    def __init__(self, directory = None, max_items = 8, max_bytes = 1 << 30):
+        """
+        Parameters
+        ----------
+        directory : str, optional
+        max_items : int, optional
+        max_bytes : int, optional
+        """
+
+        self.directory = directory
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def base_key(self, digest, line_delimiter, padding_left, padding_right, tokenizer, line_index = None, compaction = None):
+        """Builds the key of the counts of one corpus for every radius.
+
+        Parameters
+        ----------
+        digest : str
+            The hash of the corpus, from hash_text or hash_file
+        line_delimiter : str
+        padding_left : str
+        padding_right : str
+        tokenizer : CharTokenizer
+        line_index : LineSet or BloomFilter, optional
+            The kind of membership index the counts have
+        compaction : tuple, optional
+            The options the counts and their PatchIndex were compacted with
+
+        Returns
+        -------
+        str
+            The key
+        """
+
+        index = None
+        if line_index is not None:
+            index = (type(line_index).__name__, getattr(line_index, "size", None), getattr(line_index, "hashes", None))
+        parts = (digest, line_delimiter, padding_left, padding_right, type(tokenizer).__name__,
+                 sorted(tokenizer.__dict__.items()), index, compaction)
+        return hashlib.sha256(repr(parts).encode("utf-8", "surrogatepass")).hexdigest()
+
+    def _path(self, base, radius):
+        return os.path.join(self.directory, "%s-r%d.counts" % (base, radius))
+
+    def get(self, base, radius):
+        """Finds the counts of a corpus, deriving them from a higher radius if needed.
+
+        Parameters
+        ----------
+        base : str
+            The key from base_key
+        radius : int
+
+        Returns
+        -------
+        tuple (PartialCounts, PatchIndex)
+            The counts, or None if neither they nor a higher radius are cached, 
+            and the PatchIndex built from them, or None if it was not cached
+        """
+
+        counts, patch_index = self._load(base, radius)
+        if counts is None:
+            higher = [r for b, r in self.memory if b == base and r > radius]
+            if self.directory is not None:
+                for path in glob.glob(os.path.join(glob.escape(self.directory), base + "-r*.counts")):
+                    r = int(path[path.rindex("-r") + 2:-len(".counts")])
+                    if r > radius:
+                        higher.append(r)
+            if higher:
+                counts = self._load(base, min(higher))[0]
+            if counts is not None:
+                counts = counts.at_radius(radius) if getattr(counts, "min_frequency", 1) <= 1 else None
+        if counts is None:
+            self.misses = self.misses + 1
+        else:
+            self.hits = self.hits + 1
+        return counts, patch_index
+
+    def _load(self, base, radius):
+        """Finds the counts of exactly one radius, in memory then in the directory.
+
+        Parameters
+        ----------
+        base : str
+        radius : int
+
+        Returns
+        -------
+        tuple (PartialCounts, PatchIndex)
+            The counts and PatchIndex, each None if they are not cached
+        """
+
+        key = (base, radius)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.directory is None:
+            return None, None
+        path = self._path(base, radius)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None, None
+        os.utime(path)
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def put(self, base, radius, counts, patch_index = None):
+        """Caches the counts of a corpus, in memory and in the directory.
+
+        The counts and PatchIndex must not be changed afterwards, as they are shared with every later get.
+
+        Parameters
+        ----------
+        base : str
+            The key from base_key
+        radius : int
+        counts : PartialCounts
+        patch_index : PatchIndex, optional
+            The PatchIndex built from exactly these counts
+        """
+
+        entry = (counts, patch_index)
+        self._remember((base, radius), entry)
+        if self.directory is None:
+            return
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self._path(base, radius))
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used counts from the directory until it is under max_bytes.
+        """
+
+        files = []
+        for path in glob.glob(os.path.join(glob.escape(self.directory), "*.counts")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        while files and total > self.max_bytes:
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total = total - size
+
+    def clear(self):
+        """Removes every cached counts, in memory and in the directory.
+        """
+
+        self.memory.clear()
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(glob.escape(self.directory), "*.counts")):
+                os.remove(path)
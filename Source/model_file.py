@@ -0,0 +1,189 @@
+import mmap
+import struct
+import sys
+from array import array
+
+#Identifies compiled model files, and the version of their layout
+MAGIC = b"SWCM"
+VERSION = 3
+
+#magic, version, radius, phoneme count, patch count, total phonemes, word start, word end
+HEADER = struct.Struct("<4sIIIQQii")
+LENGTH = struct.Struct("<I")
+#Number of distinct line lengths
+LENGTHS = struct.Struct("<Q")
+#Number of fallback models, each stored after it as a whole model
+FALLBACKS = struct.Struct("<Q")
+
+class CompiledModel:
+    """The contents of a compiled model file.
+
+    Attributes
+    ----------
+    radius : int
+        The radius of the Patches
+    line_delimiter : str
+        What string the input text was split by
+    padding_left : str
+        The string used to pad the text to the left
+    padding_right : str
+        The string used to pad the text to the right
+    phoneme_list : list <str>
+        List of unique characters read from the text
+    total_phonemes : int
+        Total number of characters read from the text
+    word_start : int
+        The value assigned to the starting character
+    word_end : int
+        The value assigned to the ending character
+    totals : sequence <int>
+        Number of incidences of each phoneme, in the order of phoneme_list
+    cores : sequence <int>
+        The core of each Patch
+    raw_patches : sequence <int>
+        The complete sub-string of each Patch, one after the other
+    frequencies : sequence <int>
+        The frequency of each Patch
+    length_table : dict {<int> : int}
+        Number of lines of each length
+    fallbacks : list <CompiledModel>
+        The fallback models of lower radii, highest first
+    buffer : mmap.mmap
+        The memory map the sequences are read from, None if they were copied
+    """
+
+    def __init__(self):
+        self.radius = 0
+        self.line_delimiter = "\n"
+        self.padding_left = "+"
+        self.padding_right = "-"
+        self.phoneme_list = []
+        self.total_phonemes = 0
+        self.word_start = 0
+        self.word_end = 1
+        self.totals = []
+        self.cores = []
+        self.raw_patches = []
+        self.frequencies = []
+        self.length_table = {}
+        self.fallbacks = []
+        self.buffer = None
+
+def _pack_string(text):
+    """Packs a string as its UTF-8 length followed by its UTF-8 bytes."""
+    
+    data = text.encode("utf-8")
+    return LENGTH.pack(len(data)) + data
+
+def _pack_array(typecode, values):
+    """Packs integers as a little-endian array of the given typecode."""
+    
+    a = array(typecode, values)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+def write_model(path, model):
+    """Writes a model to a compiled model file.
+
+    Parameters
+    ----------
+    path : str
+        The file to write
+    model : CompiledModel
+        The model to write
+    """
+
+    with open(path, "wb") as f:
+        _write_model(f, model)
+
+def _write_model(f, model):
+    """Writes a model at the current position of a file, which must be aligned to 8 bytes, followed by its fallback models."""
+
+    strings = b"".join(_pack_string(s) for s in [model.line_delimiter, model.padding_left, model.padding_right] + model.phoneme_list)
+    f.write(HEADER.pack(MAGIC, VERSION, model.radius, len(model.phoneme_list), len(model.cores),
+                        model.total_phonemes, model.word_start, model.word_end))
+    f.write(strings)
+    #Align the arrays to 8 bytes so they can be read in place
+    f.write(b"\0"*(-f.tell() % 8))
+    f.write(_pack_array("q", model.totals))
+    f.write(_pack_array("q", model.frequencies))
+    f.write(_pack_array("i", model.cores))
+    f.write(_pack_array("i", model.raw_patches))
+    f.write(b"\0"*(-f.tell() % 8))
+    f.write(LENGTHS.pack(len(model.length_table)))
+    f.write(_pack_array("q", [x for item in sorted(model.length_table.items()) for x in item]))
+    f.write(FALLBACKS.pack(len(model.fallbacks)))
+    for fallback in model.fallbacks:
+        _write_model(f, fallback)
+
+def _read_array(view, offset, typecode, count):
+    """Reads a little-endian array at offset in place, returning it and the offset after it."""
+    
+    size = array(typecode).itemsize
+    end = offset + size*count
+    if sys.byteorder == "little":
+        values = view[offset:end].cast(typecode)
+    else:
+        values = array(typecode, view[offset:end].tobytes())
+        values.byteswap()
+    return values, end
+
+def read_model(path):
+    """Reads a compiled model file through a memory map, without copying its arrays.
+
+    Parameters
+    ----------
+    path : str
+        The file to read
+
+    Returns
+    -------
+    CompiledModel
+        The model read
+    """
+
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return _read_model(buffer, memoryview(buffer), 0, path)[0]
+
+def _read_model(buffer, view, offset, path):
+    """Reads the model at offset and its fallback models, returning it and the offset after them."""
+
+    magic, version, radius, n_phonemes, n_patches, total_phonemes, word_start, word_end = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise Exception("Not a compiled model file : " + str(path))
+    if version != VERSION:
+        raise Exception("Unsupported compiled model version : " + str(version))
+
+    offset = offset + HEADER.size
+    strings = []
+    for i in range(3 + n_phonemes):
+        (n,) = LENGTH.unpack_from(buffer, offset)
+        offset = offset + LENGTH.size
+        strings.append(bytes(view[offset:offset+n]).decode("utf-8"))
+        offset = offset + n
+    offset = offset + (-offset % 8)
+
+    model = CompiledModel()
+    model.radius = radius
+    model.line_delimiter, model.padding_left, model.padding_right = strings[:3]
+    model.phoneme_list = strings[3:]
+    model.total_phonemes = total_phonemes
+    model.word_start = word_start
+    model.word_end = word_end
+    model.totals, offset = _read_array(view, offset, "q", n_phonemes)
+    model.frequencies, offset = _read_array(view, offset, "q", n_patches)
+    model.cores, offset = _read_array(view, offset, "i", n_patches)
+    model.raw_patches, offset = _read_array(view, offset, "i", n_patches*(2*radius + 1))
+    offset = offset + (-offset % 8)
+    (n_lengths,) = LENGTHS.unpack_from(buffer, offset)
+    lengths, offset = _read_array(view, offset + LENGTHS.size, "q", 2*n_lengths)
+    model.length_table = dict(zip(lengths[0::2], lengths[1::2]))
+    (n_fallbacks,) = FALLBACKS.unpack_from(buffer, offset)
+    offset = offset + FALLBACKS.size
+    for i in range(n_fallbacks):
+        fallback, offset = _read_model(buffer, view, offset, path)
+        model.fallbacks.append(fallback)
+    model.buffer = buffer
+    return model, offset
\ No newline at end of file
@@ -0,0 +1,178 @@
+import hashlib
+import math
+
+def _key_bytes(key):
+    """Converts the key of a line to bytes to hash.
+
+    Parameters
+    ----------
+    key : str or tuple <str>
+        The key of the line, made by a tokenizer
+
+    Returns
+    -------
+    bytes
+        The bytes of the key
+    """
+
+    if isinstance(key, tuple):
+        key = "\x00".join(key)
+    return key.encode("utf-8", "surrogatepass")
+
+class LineSet:
+    """Exact membership index of the lines of a corpus, kept in a hash set.
+
+    Attributes
+    ----------
+    lines : set
+        The key of every line added
+    """
+
+    def __init__(self):
+        self.lines = set()
+
+    def add(self, key):
+        """Adds the key of one line.
+
+        Parameters
+        ----------
+        key : str or tuple <str>
+        """
+
+        self.lines.add(key)
+
+    def __contains__(self, key):
+        return key in self.lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def empty(self):
+        """Makes an empty index of the same kind, such as for counting one shard.
+
+        Returns
+        -------
+        LineSet
+        """
+
+        return LineSet()
+
+    def merge(self, other):
+        """Adds every line of another index of the same kind.
+
+        Parameters
+        ----------
+        other : LineSet
+
+        Returns
+        -------
+        LineSet
+            This index
+        """
+
+        self.lines.update(other.lines)
+        return self
+
+class BloomFilter:
+    """Approximate membership index of the lines of a huge corpus, in a fixed amount of memory.
+
+    A line that was added is always found, and a line that was not is found with a probability
+    of about error_rate once capacity lines were added.
+
+    Attributes
+    ----------
+    capacity : int
+        The number of lines the filter is sized for
+    error_rate : float
+        The false positive rate at capacity
+    size : int
+        The number of bits of the filter
+    hashes : int
+        The number of bits set for each line
+    bits : bytearray
+        The bits of the filter
+    count : int
+        The number of lines added
+    """
+
+    def __init__(self, capacity = 1 << 20, error_rate = 0.01):
+        """
+        Parameters
+        ----------
+        capacity : int, optional
+        error_rate : float, optional
+        """
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity*math.log(error_rate)/math.log(2)**2)))
+        self.hashes = max(1, int(round(self.size/capacity*math.log(2))))
+        self.bits = bytearray((self.size + 7) >> 3)
+        self.count = 0
+
+    def _positions(self, key):
+        """Finds the bits of one line by double hashing.
+
+        Parameters
+        ----------
+        key : str or tuple <str>
+
+        Returns
+        -------
+        list <int>
+            The position of each bit
+        """
+
+        digest = hashlib.blake2b(_key_bytes(key), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i*second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Adds the key of one line.
+
+        Parameters
+        ----------
+        key : str or tuple <str>
+        """
+
+        for i in self._positions(key):
+            self.bits[i >> 3] = self.bits[i >> 3] | (1 << (i & 7))
+        self.count = self.count + 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+    def empty(self):
+        """Makes an empty filter with the same size, such as for counting one shard.
+
+        Returns
+        -------
+        BloomFilter
+        """
+
+        return BloomFilter(self.capacity, self.error_rate)
+
+    def merge(self, other):
+        """Adds every line of another filter with the same size.
+
+        Parameters
+        ----------
+        other : BloomFilter
+
+        Returns
+        -------
+        BloomFilter
+            This filter
+        """
+
+        if other.size != self.size or other.hashes != self.hashes:
+            raise Exception("Cannot merge Bloom filters of different sizes")
+        self.bits = bytearray((int.from_bytes(self.bits, "little") | int.from_bytes(other.bits, "little"))
+                              .to_bytes(len(self.bits), "little"))
+        self.count = self.count + other.count
+        return self
@@ -0,0 +1,573 @@
+import mmap
+import re
+import sys
+from collections import Counter
+from tokenizer import CharTokenizer, ByteTokenizer
+from count_min_sketch import CountMinSketch
+
+class PartialCounts:
+    """Counts of the sub-strings of part of a corpus, which can be merged with the counts of other parts.
+
+    Merging is associative, so a corpus can be split into shards that are
+    counted separately, even in other processes, and reduced in any grouping.
+
+    Attributes
+    ----------
+    radius : int
+        What radius of sub-strings to count
+    padding_left : str
+        The string used to pad each line to the left
+    padding_right : str
+        The string used to pad each line to the right
+    count_table : dict {<str> : dict {<str> : <int>} }
+        Table for counting sub-strings by central character
+    total_table : dict {<str> : int}
+        Table for counting incidences of each character
+    total_phonemes : int
+        Total number of characters counted
+    phoneme_list : list <str>
+        List of unique characters counted, in the order they were first seen
+    length_table : dict {<int> : int}
+        Table for counting lines by their length in phonemes
+    tokenizer : CharTokenizer
+        How lines are split into phonemes
+    line_index : LineSet or BloomFilter
+        The membership index every line is added to, or None
+    min_frequency : int
+        The smallest estimated count of the sub-strings kept by a sketched count, 1 if every sub-string was kept
+    """
+
+    def __init__(self, radius, padding_left = "+", padding_right = "-", tokenizer = None, line_index = None):
+        """
+        Parameters
+        ----------
+        radius : int
+        padding_left : str, optional
+        padding_right : str, optional
+        tokenizer : CharTokenizer, optional
+            How lines are split into phonemes, single characters if None
+        line_index : LineSet or BloomFilter, optional
+            The membership index to add every line to
+        """
+
+        self.radius = radius
+        self.tokenizer = tokenizer if tokenizer is not None else CharTokenizer()
+        self.line_index = line_index
+        self.padding_left = padding_left
+        self.padding_right = padding_right
+        self.count_table = {}
+        self.total_table = {}
+        self.total_phonemes = 0
+        self.phoneme_list = []
+        self.length_table = {}
+        self.min_frequency = 1
+
+    def add_line(self, line):
+        """Counts every sub-string of one padded line.
+
+        Parameters
+        ----------
+        line : str or bytes
+            The line to count, without its delimiter
+        """
+
+        self.add_lines([line])
+
+    def add_lines(self, lines, sketch = None, min_frequency = 1, batch_size = 1 << 14):
+        """Counts every sub-string of many lines.
+
+        The sub-strings are first counted in bulk, as slices of the split lines, then each
+        distinct one is converted to its key and added to the tables once.
+
+        With a sketch of these same lines from sketch_lines, the lines are counted in batches
+        and only the sub-strings estimated to occur at least min_frequency times are added
+        to count_table, so the sub-strings too rare to keep are never held beyond one batch.
+        As the sketch never underestimates, every sub-string kept is counted exactly, but
+        some with a lower count may be kept too. total_table still counts every sub-string.
+
+        Parameters
+        ----------
+        lines : iterable <str or bytes>
+            The lines to count, without their delimiters
+        sketch : CountMinSketch, optional
+            The sketch of the lines, to keep only the frequent sub-strings
+        min_frequency : int, optional
+            The smallest estimated count of a sub-string kept with a sketch
+        batch_size : int, optional
+            How many lines to count at a time with a sketch
+        """
+
+        if sketch is None:
+            for windows in self.iter_windows(lines, None, True):
+                self.add_windows(windows)
+            return
+        self.min_frequency = max(self.min_frequency, min_frequency)
+        for windows in self.iter_windows(lines, batch_size, True):
+            kept = {}
+            for patch_text, count in windows.items():
+                if sketch.estimate(patch_text) >= min_frequency:
+                    kept[patch_text] = count
+                else:
+                    self.add_total(patch_text[self.radius], count)
+            self.add_windows(kept)
+
+    def sketch_lines(self, lines, sketch, batch_size = 1 << 14):
+        """Adds the sub-strings of many lines to a sketch, without changing the tables.
+
+        This is the first pass of a sketched count, to be followed by add_lines with the sketch
+        over the same lines.
+
+        Parameters
+        ----------
+        lines : iterable <str or bytes>
+            The lines to count, without their delimiters
+        sketch : CountMinSketch
+            The sketch to add to
+        batch_size : int, optional
+            How many lines to count at a time
+        """
+
+        for windows in self.iter_windows(lines, batch_size, False):
+            sketch.update(windows)
+
+    def iter_windows(self, lines, batch_size = None, record = True):
+        """Counts the sub-strings of many lines, in batches of lines.
+
+        Parameters
+        ----------
+        lines : iterable <str or bytes>
+            The lines to count, without their delimiters
+        batch_size : int, optional
+            How many lines to count at a time, all of them if None
+        record : bool, optional
+            If the lines are added to length_table and line_index
+
+        Yields
+        ------
+        dict {<str or tuple> : int}
+            The number of occurences of each sub-string of a batch, by key, in the order they were first seen
+        """
+
+        tokenizer = self.tokenizer
+        line_index = self.line_index if record else None
+        left = tokenizer.pad(self.padding_left, self.radius+1)
+        right = tokenizer.pad(self.padding_right, self.radius+1)
+        length = 2*self.radius + 1
+        windows = Counter()
+        size = 0
+        for line in lines:
+            tokens = tokenizer.split(line)
+            if record:
+                self.length_table[len(tokens)] = self.length_table.get(len(tokens), 0) + 1
+            if line_index is not None:
+                line_index.add(tokenizer.key(tokens))
+            padded_word = left + tokens + right
+            windows.update([padded_word[i:i+length] for i in range(len(padded_word) - length + 1)])
+            size = size + 1
+            if size == batch_size:
+                yield self._keys(windows)
+                windows = Counter()
+                size = 0
+        if size > 0 or batch_size is None:
+            yield self._keys(windows)
+
+    def _keys(self, windows):
+        tokenizer = self.tokenizer
+        if type(tokenizer) is CharTokenizer:
+            return windows
+        keys = {}
+        for window, count in windows.items():
+            key = tokenizer.key(window)
+            keys[key] = keys.get(key, 0) + count
+        return keys
+
+    def add_windows(self, windows):
+        """Adds counted sub-strings to the tables.
+
+        Parameters
+        ----------
+        windows : dict {<str or tuple> : int}
+            The number of occurences of each sub-string, in the order they were first seen
+        """
+
+        for patch_text, count in windows.items():
+            phoneme = patch_text[self.radius]
+            self.add_total(phoneme, count)
+            table = self.count_table[phoneme]
+            table[patch_text] = table.get(patch_text, 0) + count
+
+    def add_total(self, phoneme, count):
+        """Counts occurences of a central character, adding it to the tables if it is new.
+
+        Parameters
+        ----------
+        phoneme : str
+        count : int
+        """
+
+        if phoneme not in self.count_table:
+            self.phoneme_list.append(phoneme)
+            self.count_table[phoneme] = {}
+            self.total_table[phoneme] = 0
+        self.total_table[phoneme] = self.total_table[phoneme] + count
+        self.total_phonemes = self.total_phonemes + count
+
+    def merge(self, other):
+        """Adds the counts of another part of the corpus to these counts.
+
+        Parameters
+        ----------
+        other : PartialCounts
+            The counts to add, made with the same radius, padding and tokenizer
+
+        Returns
+        -------
+        PartialCounts
+            These counts, so that merges can be chained or reduced
+        """
+
+        if (other.radius, other.padding_left, other.padding_right) != (self.radius, self.padding_left, self.padding_right):
+            raise Exception("Cannot merge counts made with a different radius or padding")
+        if other.tokenizer != self.tokenizer:
+            raise Exception("Cannot merge counts made with a different tokenizer")
+        for phoneme in other.phoneme_list:
+            if phoneme not in self.count_table:
+                self.phoneme_list.append(phoneme)
+                self.count_table[phoneme] = {}
+                self.total_table[phoneme] = 0
+            table = self.count_table[phoneme]
+            for patch_text, count in other.count_table[phoneme].items():
+                table[patch_text] = table.get(patch_text, 0) + count
+            self.total_table[phoneme] = self.total_table[phoneme] + other.total_table[phoneme]
+        self.total_phonemes = self.total_phonemes + other.total_phonemes
+        for length, count in other.length_table.items():
+            self.length_table[length] = self.length_table.get(length, 0) + count
+        if other.line_index is not None and other.line_index is not self.line_index:
+            if self.line_index is None:
+                self.line_index = other.line_index.empty()
+            self.line_index.merge(other.line_index)
+        self.min_frequency = max(self.min_frequency, other.min_frequency)
+        return self
+
+    def subtract(self, other):
+        """Removes the counts of part of the corpus from these counts, such as lines read by mistake.
+
+        Sub-strings whose count reaches 0 are removed from count_table, as well as the ones already 
+        dropped by compact. line_index can not forget lines, so it is left as it is.
+
+        Parameters
+        ----------
+        other : PartialCounts
+            The counts to remove, made with the same radius, padding and tokenizer
+
+        Returns
+        -------
+        PartialCounts
+            These counts
+        """
+
+        if (other.radius, other.padding_left, other.padding_right) != (self.radius, self.padding_left, self.padding_right):
+            raise Exception("Cannot subtract counts made with a different radius or padding")
+        if other.tokenizer != self.tokenizer:
+            raise Exception("Cannot subtract counts made with a different tokenizer")
+        for phoneme in other.phoneme_list:
+            if self.total_table.get(phoneme, 0) < other.total_table[phoneme]:
+                raise Exception("Cannot subtract counts that were never added")
+        for length, count in other.length_table.items():
+            if self.length_table.get(length, 0) < count:
+                raise Exception("Cannot subtract counts that were never added")
+        for phoneme in other.phoneme_list:
+            table = self.count_table[phoneme]
+            for patch_text, count in other.count_table[phoneme].items():
+                count = table.get(patch_text, 0) - count
+                if count > 0:
+                    table[patch_text] = count
+                elif patch_text in table:
+                    del table[patch_text]
+            self.total_table[phoneme] = self.total_table[phoneme] - other.total_table[phoneme]
+        self.total_phonemes = self.total_phonemes - other.total_phonemes
+        for length, count in other.length_table.items():
+            self.length_table[length] = self.length_table[length] - count
+            if self.length_table[length] == 0:
+                del self.length_table[length]
+        return self
+
+    def compact(self, min_frequency = 1, top_k = None, phonemes = None):
+        """Drops the rare sub-strings from count_table, keeping total_table as the counts of the whole corpus.
+
+        Parameters
+        ----------
+        min_frequency : int, optional
+            The smallest count of a sub-string kept
+        top_k : int, optional
+            The largest number of sub-strings kept for each central character, the most frequent first, 
+            or None to keep all of them
+        phonemes : iterable <str>, optional
+            The central characters whose sub-strings are compacted, every one if None
+
+        Returns
+        -------
+        dict {<str or tuple> : int}
+            The count of every sub-string dropped
+        """
+
+        dropped = {}
+        for phoneme in (phonemes if phonemes is not None else self.phoneme_list):
+            table = self.count_table[phoneme]
+            kept = [(patch_text, count) for patch_text, count in table.items() if count >= min_frequency]
+            if top_k is not None and len(kept) > top_k:
+                ranked = sorted(range(len(kept)), key=lambda i: -kept[i][1])
+                kept = [kept[i] for i in sorted(ranked[:top_k])]
+            if len(kept) < len(table):
+                kept = dict(kept)
+                dropped.update((patch_text, count) for patch_text, count in table.items() if patch_text not in kept)
+                self.count_table[phoneme] = kept
+        return dropped
+
+    def coverage(self):
+        """Finds the share of the sub-strings counted that are still in count_table.
+
+        Returns
+        -------
+        float
+            The occurences of the sub-strings kept over the occurences of every sub-string, 1 if none were counted
+        """
+
+        if self.total_phonemes == 0:
+            return 1.0
+        return sum(sum(table.values()) for table in self.count_table.values())/self.total_phonemes
+
+    def memory(self):
+        """Estimates the bytes used by count_table.
+
+        Returns
+        -------
+        int
+        """
+
+        size = sys.getsizeof(self.count_table)
+        for table in self.count_table.values():
+            size = size + sys.getsizeof(table) + sum(sys.getsizeof(patch_text) for patch_text in table)
+        return size
+
+    def at_radius(self, radius, index_lines = True):
+        """Derives the counts of a lower radius from these counts, without reading the lines again.
+
+        Each line is padded by one more element than the radius at either end, so both radii
+        have one sub-string per element of the padded line, centered on the same element, and
+        the sub-string of the lower radius is the middle of the sub-string of this one.
+
+        Parameters
+        ----------
+        radius : int
+            The radius to derive, at most the radius of these counts
+        index_lines : bool, optional
+            If the new counts get a copy of line_index
+
+        Returns
+        -------
+        PartialCounts
+            The new counts
+        """
+
+        if radius > self.radius:
+            raise Exception("Cannot derive counts of a higher radius")
+        if self.min_frequency > 1:
+            raise Exception("Cannot derive counts from a sketched count, which dropped sub-strings")
+        line_index = None
+        if index_lines and self.line_index is not None:
+            line_index = self.line_index.empty().merge(self.line_index)
+        counts = PartialCounts(radius, self.padding_left, self.padding_right, self.tokenizer, line_index)
+        start = self.radius - radius
+        end = self.radius + radius + 1
+        for phoneme in self.phoneme_list:
+            counts.phoneme_list.append(phoneme)
+            table = {}
+            for patch_text, count in self.count_table[phoneme].items():
+                key = patch_text[start:end]
+                table[key] = table.get(key, 0) + count
+            counts.count_table[phoneme] = table
+            counts.total_table[phoneme] = self.total_table[phoneme]
+        counts.total_phonemes = self.total_phonemes
+        counts.length_table = dict(self.length_table)
+        return counts
+
+def iter_lines(source, line_delimiter = "\n", chunk_size = 1 << 20):
+    """Reads lines from a file in chunks, splitting them exactly as str.split would.
+
+    Parameters
+    ----------
+    source : str or file
+        The path of a text file, or a file opened in text mode
+    line_delimiter : str, optional
+        What string to split the text by
+    chunk_size : int, optional
+        How many characters to read at a time
+
+    Yields
+    ------
+    str
+        Each line, without its delimiter
+    """
+
+    if isinstance(source, str):
+        with open(source, "r") as f:
+            yield from iter_lines(f, line_delimiter, chunk_size)
+        return
+    rest = ""
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        lines = (rest + chunk).split(line_delimiter)
+        rest = lines.pop()
+        yield from lines
+    yield rest
+
+def iter_byte_lines(source, line_delimiter = b"\n"):
+    """Splits bytes into lines exactly as bytes.split would, copying one line at a time.
+
+    Parameters
+    ----------
+    source : bytes, memoryview, mmap.mmap or str
+        The bytes to split, or the path of a file to memory map
+    line_delimiter : bytes, optional
+        What bytes to split the lines by
+
+    Yields
+    ------
+    bytes
+        Each line, without its delimiter
+    """
+
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            if f.seek(0, 2) == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield from iter_byte_lines(buffer, line_delimiter)
+        return
+    start = 0
+    for match in re.finditer(re.escape(line_delimiter), source):
+        yield bytes(source[start:match.start()])
+        start = match.end()
+    yield bytes(source[start:])
+
+def count_file(path, radius, padding_left = "+", padding_right = "-", line_delimiter = "\n", chunk_size = 1 << 20, tokenizer = None,
+               line_index = None, min_frequency = 1, sketch_width = 0, sketch_depth = 4, sketch = None):
+    """Counts the sub-strings of one file, such as one shard of a corpus.
+
+    With a ByteTokenizer, the file is memory mapped and never decoded. With a sketch_width, 
+    the file is read twice, first into a CountMinSketch, then to count only the frequent sub-strings.
+    With a sketch of the whole corpus from sketch_file, the file is read once, keeping the 
+    sub-strings frequent in the whole corpus rather than in this file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the text file
+    radius : int
+        What radius of sub-strings to count
+    padding_left : str, optional
+    padding_right : str, optional
+    line_delimiter : str, optional
+    chunk_size : int, optional
+        How many characters to read at a time
+    tokenizer : CharTokenizer, optional
+        How lines are split into phonemes, single characters if None
+    line_index : LineSet or BloomFilter, optional
+        The membership index to add every line to
+    min_frequency : int, optional
+        The smallest estimated count of the sub-strings kept with a sketch
+    sketch_width : int, optional
+        The width of the CountMinSketch, 0 to count every sub-string
+    sketch_depth : int, optional
+        The depth of the CountMinSketch
+    sketch : CountMinSketch, optional
+        The merged sketch of every file of the corpus, used instead of sketching this one
+
+    Returns
+    -------
+    PartialCounts
+        The counts of the file
+    """
+
+    counts = PartialCounts(radius, padding_left, padding_right, tokenizer, line_index)
+    get_lines = _file_lines(path, line_delimiter, chunk_size, counts.tokenizer)
+    if sketch is not None:
+        counts.add_lines(get_lines(), sketch, min_frequency)
+    else:
+        count_source(counts, get_lines, min_frequency, sketch_width, sketch_depth)
+    return counts
+
+def sketch_file(path, radius, padding_left = "+", padding_right = "-", line_delimiter = "\n", chunk_size = 1 << 20, tokenizer = None,
+                sketch_width = 1 << 20, sketch_depth = 4):
+    """Sketches the sub-strings of one file, the first pass of a sketched count of a sharded corpus.
+
+    The sketches of every file can be merged, then given to count_file for the second pass.
+
+    Parameters
+    ----------
+    path : str
+        The path of the text file
+    radius : int
+        What radius of sub-strings to sketch
+    padding_left : str, optional
+    padding_right : str, optional
+    line_delimiter : str, optional
+    chunk_size : int, optional
+        How many characters to read at a time
+    tokenizer : CharTokenizer, optional
+        How lines are split into phonemes, single characters if None
+    sketch_width : int, optional
+        The width of the CountMinSketch
+    sketch_depth : int, optional
+        The depth of the CountMinSketch
+
+    Returns
+    -------
+    CountMinSketch
+        The sketch of the file
+    """
+
+    counts = PartialCounts(radius, padding_left, padding_right, tokenizer)
+    sketch = CountMinSketch(sketch_width, sketch_depth)
+    counts.sketch_lines(_file_lines(path, line_delimiter, chunk_size, counts.tokenizer)(), sketch)
+    return sketch
+
+def _file_lines(path, line_delimiter, chunk_size, tokenizer):
+    if isinstance(tokenizer, ByteTokenizer):
+        delimiter = line_delimiter.encode(tokenizer.encoding)
+        return lambda: iter_byte_lines(path, delimiter)
+    return lambda: iter_lines(path, line_delimiter, chunk_size)
+
+def count_source(counts, get_lines, min_frequency = 1, sketch_width = 0, sketch_depth = 4):
+    """Counts the lines of a corpus, in two passes through a CountMinSketch if sketch_width is set.
+
+    Parameters
+    ----------
+    counts : PartialCounts
+        The counts to add to
+    get_lines : function
+        Called without arguments to get the lines of the corpus, once or twice
+    min_frequency : int, optional
+        The smallest estimated count of the sub-strings kept with a sketch
+    sketch_width : int, optional
+        The width of the CountMinSketch, 0 to count every sub-string
+    sketch_depth : int, optional
+        The depth of the CountMinSketch
+
+    Returns
+    -------
+    CountMinSketch
+        The sketch of the corpus, or None if it was not sketched
+    """
+
+    if sketch_width <= 0 or min_frequency <= 1:
+        counts.add_lines(get_lines())
+        return None
+    sketch = CountMinSketch(sketch_width, sketch_depth)
+    counts.sketch_lines(get_lines(), sketch)
+    counts.add_lines(get_lines(), sketch, min_frequency)
+    return sketch
\ No newline at end of file
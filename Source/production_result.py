@@ -0,0 +1,42 @@
+class ProductionResult:
+    """One string produced by a TextWaveHandler, with how it was produced.
+
+    Attributes
+    ----------
+    text : str
+        The string produced, or None if the attempts ran out first
+    attempts : int
+        The number of Waves collapsed to produce this string
+    seconds : float
+        The time taken to produce this string
+    maxed_out : bool
+        True if the maximum number of attempts ran out before a string was produced
+    radius : int
+        The radius of the model that completed the string, lower than the radius of the handler 
+        if its Wave failed and a fallback model completed it, or None if no string was produced
+    fallback : int
+        The number of positions of the Wave decided by fallback models instead of the model of the handler
+    """
+
+    def __init__(self, text, attempts, seconds, maxed_out = False, radius = None, fallback = 0):
+        """
+        Parameters
+        ----------
+        text : str
+        attempts : int
+        seconds : float
+        maxed_out : bool, optional
+        radius : int, optional
+        fallback : int, optional
+        """
+
+        self.text = text
+        self.attempts = attempts
+        self.seconds = seconds
+        self.maxed_out = maxed_out
+        self.radius = radius
+        self.fallback = fallback
+
+    def __repr__(self):
+        return "ProductionResult(%r, attempts=%d, seconds=%.6f, maxed_out=%r, radius=%r, fallback=%d)" % (
+            self.text, self.attempts, self.seconds, self.maxed_out, self.radius, self.fallback)
\ No newline at end of file
@@ -1,4 +1,51 @@
+import time
+import random
+import multiprocessing
 from wave_function_package import *
+from production_result import ProductionResult
+from model_file import CompiledModel, write_model, read_model
+from partial_counts import PartialCounts, iter_lines, iter_byte_lines, count_file, count_source, sketch_file
+from tokenizer import CharTokenizer, ByteTokenizer
+from novelty_index import LineSet, BloomFilter
+from model_cache import hash_text, hash_file
+
+#The handler shared by every task of a worker process in produce_parallel
+_worker_handler = None
+
+def _init_worker(handler):
+    """Keeps the handler of produce_parallel for every task run by this worker process.
+    
+    Parameters
+    ----------
+    handler : TextWaveHandler
+        The handler with the model to produce from
+    """
+    
+    global _worker_handler
+    _worker_handler = handler
+    
+def _produce_chunk(task):
+    """Produces one chunk of the strings of produce_parallel in a worker process.
+    
+    Parameters
+    ----------
+    task : tuple (int, int, int)
+        The number of strings to produce, the maximum number of attempts and the seed of the chunk
+    
+    Returns
+    -------
+    tuple (list <ProductionResult>, dict)
+        Each string produced, ending with a result with no text if the attempts ran out, 
+        and the exported stats of the chunk if the handler is instrumented
+    """
+    
+    n, max_out, seed = task
+    _worker_handler.rng = random.Random(seed)
+    _worker_handler.batch_waves = {}
+    _worker_handler.nogoods = {}
+    results = _worker_handler.produce_batch(n, max_out)
+    stats = _worker_handler.stats.to_dict() if _worker_handler.stats is not None else None
+    return results, stats
 
 class TextWaveHandler:
     """Manipulates text to work in the generic wave collapse function.
@@ -19,21 +66,98 @@ class TextWaveHandler:
         Total number of characters read from the input text
     patches_list : list <Patch>
         List of patches produced from the input text
+    patch_index : PatchIndex
+        Compatibility index of patches_list, shared by every Wave
+    shared_index : bool
+        If patch_index is shared with model_cache, so that it is copied before being changed
     phoneme_list : list <str>
         List of unique characters read from the text
+    phoneme_ids : dict {<str> : int}
+        The position of each character in phoneme_list
     word_start : int
         The value assigned to the starting character
     word_end : int
         The value assigned to the ending character
     wave : Wave
         The Wave object built to produce similar text to the input text
+    templates : dict {<tuple> : list <WaveElement>}
+        The initial super-position compiled by the first Wave of each size, reused by every later Wave,
+        indexed by (size, exact_length)
     padding_left : str
         The string used to pad the text to the left
     padding_right : str
         The string used to pad the text to the right
+    heuristic : str
+        How the Wave picks the next element to collapse, "entropy" or "normalization"
+    max_backtracks : int
+        How many failed decisions a Wave may undo before the attempt is restarted, 0 to always restart
+    rng : random.Random
+        The source of randomness for every Wave, the global random module if None
+    length_table : dict {<int> : int}
+        Table for counting lines of the input text by their length
+    variable_length : bool
+        If each Wave is sized to a length drawn from length_table instead of max_size
+    min_length : int
+        The shortest length drawn when variable_length is set
+    max_length : int
+        The longest length drawn when variable_length is set, or None for no bound
+    constraints : dict {<int> : set <str>}
+        The characters allowed at some positions of the text, negative positions counting from the end
+    infeasible_lengths : set <int>
+        The sizes of Wave found to be impossible under the constraints
+    engine : str
+        "wave" to collapse Waves, "automaton" to sample from the PatchAutomaton without failed attempts, 
+        or "batch" to collapse batch_size Waves at once with numpy. With variable_length, the batch engine 
+        collapses one Wave at a time like the wave engine, since a batch holds Waves of a single length
+    batch_size : int
+        The number of Waves collapsed at once by the batch engine
+    batch_waves : dict {<int> : BatchWave}
+        The batches of the batch engine, by size of Wave
+    automaton : PatchAutomaton
+        The automaton compiled from patches_list, built when first needed
+    scorer : PatchScorer
+        The scorer of the Patches, built when first needed
+    stats : CollapseStats
+        The counters and timers of the last production, None unless instrument was called
+    tokenizer : CharTokenizer
+        How lines are split into phonemes, such as a ByteTokenizer or a TrieTokenizer
+    novelty_index : LineSet or BloomFilter
+        The membership index of the lines read, whose strings are never produced, or None to allow them
+    unique : bool
+        If each production skips the strings it already produced
+    model_cache : ModelCache
+        The cache of the counts of every text and file read, or None to always count them
+    max_nogoods : int
+        How many contradictions each template keeps learned for later Waves, 0 to not learn them
+    nogood_size : int
+        The largest number of decisions in a learned contradiction
+    nogoods : dict {<tuple> : NogoodStore}
+        The contradictions learned for each template, indexed like templates
+    min_frequency : int
+        The smallest count of the sub-strings kept in the model, rarer ones being dropped when text is read
+    top_k : int
+        The largest number of sub-strings kept for each central character, or None to keep all of them
+    sketch_width : int
+        The width of the CountMinSketch that text is first read into, to never hold the sub-strings rarer 
+        than min_frequency, or 0 to count every sub-string
+    sketch_depth : int
+        The depth of the CountMinSketch
+    dropped_windows : int
+        The number of distinct sub-strings dropped from the model by min_frequency and top_k
+    sketch_bytes : int
+        The bytes used by the last CountMinSketch
+    fallback_radii : list <int>
+        The radii of the fallback models, highest first
+    fallbacks : list <TextWaveHandler>
+        The fallback models, derived from the counts of every text read or loaded with the model, 
+        which complete a Wave of this model that failed, from the highest radius down
     """
     
-    def __init__(self, line_delimiter = '\n',max_size=10,radius=1,padding_left="+",padding_right="-"):
+    def __init__(self, line_delimiter = '\n',max_size=10,radius=1,padding_left="+",padding_right="-",heuristic="entropy",
+                 max_backtracks=100,rng=None,variable_length=False,min_length=1,max_length=None,engine="wave",
+                 batch_size=64,tokenizer=None,novelty=None,unique=False,
+                 cache=None,max_nogoods=1000,nogood_size=3,min_frequency=1,top_k=None,sketch_width=0,sketch_depth=4,
+                 fallback_radii=()):
         """    
         Parameters
         ----------
@@ -42,6 +166,27 @@ class TextWaveHandler:
         radius : int
         padding_left : str
         padding_right : str
+        heuristic : str
+        max_backtracks : int
+        rng : random.Random
+        variable_length : bool
+        min_length : int
+        max_length : int
+        engine : str
+        batch_size : int
+        tokenizer : CharTokenizer
+        novelty : str or LineSet or BloomFilter
+            "set" or "bloom" to index the lines read in a new LineSet or BloomFilter, or the index to use
+        unique : bool
+        cache : ModelCache
+        max_nogoods : int
+        nogood_size : int
+        min_frequency : int
+        top_k : int
+        sketch_width : int
+        sketch_depth : int
+        fallback_radii : iterable <int>
+            The radii of the fallback models, each lower than radius
         """
         
         self.line_delimiter = line_delimiter
@@ -51,12 +196,54 @@ class TextWaveHandler:
         self.total_table = {}
         self.total_phonemes = 0
         self.patches_list = []
+        self.patch_index = None
+        self.shared_index = False
         self.phoneme_list = []
+        self.phoneme_ids = {}
         self.word_start = 0
         self.word_end = 1
         self.padding_left = padding_left
         self.padding_right = padding_right
+        self.heuristic = heuristic
+        self.max_backtracks = max_backtracks
+        self.rng = rng
+        self.length_table = {}
+        self.variable_length = variable_length
+        self.min_length = min_length
+        self.max_length = max_length
+        self.constraints = {}
+        self.infeasible_lengths = set()
+        self.engine = engine
+        self.automaton = None
+        self.scorer = None
+        self.batch_size = batch_size
+        self.batch_waves = {}
+        self.stats = None
         self.wave = None
+        self.templates = {}
+        self.nogoods = {}
+        self.tokenizer = tokenizer if tokenizer is not None else CharTokenizer()
+        if novelty == "set":
+            novelty = LineSet()
+        elif novelty == "bloom":
+            novelty = BloomFilter()
+        self.novelty_index = novelty
+        self.unique = unique
+        self.model_cache = cache
+        self.max_nogoods = max_nogoods
+        self.nogood_size = nogood_size
+        self.min_frequency = min_frequency
+        self.top_k = top_k
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.dropped_windows = 0
+        self.sketch_bytes = 0
+        if any(r < 0 or r >= radius for r in fallback_radii):
+            raise Exception("The radii of the fallback models must be lower than radius")
+        if fallback_radii and sketch_width > 0 and min_frequency > 1:
+            raise Exception("Fallback models are derived from exact counts, so they can not be used with a sketched count")
+        self.fallback_radii = sorted(set(fallback_radii), reverse=True)
+        self.make_fallbacks()
         
     def num_to_phoneme(self,num):
         """Converts from the wave's representation of a value to the original string.
@@ -88,59 +275,979 @@ class TextWaveHandler:
             The converted value
         """
         
-        return self.phoneme_list.index(text)
+        return self.phoneme_ids[text]
     
+    def make_fallbacks(self):
+        """Creates an empty fallback model for each radius of fallback_radii lower than radius.
+        """
+        
+        self.fallbacks = [TextWaveHandler(self.line_delimiter, self.max_size, r, self.padding_left, self.padding_right,
+                                          self.heuristic, self.max_backtracks, self.rng, self.variable_length,
+                                          self.min_length, self.max_length, "wave", self.batch_size, self.tokenizer,
+                                          max_nogoods=0, min_frequency=self.min_frequency, top_k=self.top_k)
+                          for r in self.fallback_radii if r < self.radius]
+        
     def read_text(self,text):
         """Reads the input text and captures all values to generate the wave function super-position derived from it.
         
+        Parameters
+        ----------
+        text : str or bytes
+            The string to read, or its bytes with a ByteTokenizer
+        """
+        
+        if not isinstance(text, str):
+            self.read_bytes(text)
+        elif self.model_cache is not None:
+            self.read_cached(hash_text(text), lambda: text.split(self.line_delimiter))
+        else:
+            self.read_lines(text.split(self.line_delimiter))
+        
+    def read_bytes(self, data):
+        """Reads encoded text with a ByteTokenizer, one line at a time and without decoding it.
+        
+        Parameters
+        ----------
+        data : bytes, memoryview, mmap.mmap or str
+            The bytes to read, or the path of a file to memory map
+        """
+        
+        if not isinstance(self.tokenizer, ByteTokenizer):
+            raise Exception("Reading bytes needs a ByteTokenizer")
+        delimiter = self.line_delimiter.encode(self.tokenizer.encoding)
+        if self.model_cache is not None:
+            digest = hash_file(data) if isinstance(data, str) else hash_text(data)
+            self.read_cached(digest, lambda: iter_byte_lines(data, delimiter))
+        else:
+            self.read_counts(self.count_source(lambda: iter_byte_lines(data, delimiter)))
+        
+    def read_lines(self, lines):
+        """Reads lines of text one at a time, without needing the whole text in memory.
+        
+        Parameters
+        ----------
+        lines : iterable <str>
+            The lines to read, without their delimiters
+        """
+        
+        self.read_counts(self.count_lines(lines))
+        
+    def read_file(self, path, chunk_size = 1 << 20):
+        """Reads a text file in chunks, splitting it by line_delimiter.
+        
+        With a ByteTokenizer, the file is memory mapped and never decoded.
+        
+        Parameters
+        ----------
+        path : str
+            The path of the text file
+        chunk_size : int, optional
+            How many characters to read at a time
+        """
+        
+        if isinstance(self.tokenizer, ByteTokenizer):
+            self.read_bytes(path)
+        elif self.model_cache is not None:
+            self.read_cached(hash_file(path), lambda: iter_lines(path, self.line_delimiter, chunk_size))
+        else:
+            self.read_counts(self.count_source(lambda: iter_lines(path, self.line_delimiter, chunk_size)))
+        
+    def read_cached(self, digest, get_lines):
+        """Reads the counts of a corpus from model_cache, or counts it and caches the counts.
+        
+        Parameters
+        ----------
+        digest : str
+            The hash of the corpus, from hash_text or hash_file
+        get_lines : function
+            Called without arguments to get the lines of the corpus if its counts are not cached
+        """
+        
+        index = self.novelty_index
+        compaction = (self.min_frequency, self.top_k, self.sketch_width, self.sketch_depth)
+        base = self.model_cache.base_key(digest, self.line_delimiter, self.padding_left, self.padding_right,
+                                         self.tokenizer, index, compaction)
+        counts, patch_index = self.model_cache.get(base, self.radius)
+        if counts is None:
+            counts = PartialCounts(self.radius, self.padding_left, self.padding_right, self.tokenizer,
+                                   index.empty() if index is not None else None)
+            self.count_source(get_lines, counts)
+        empty = len(self.phoneme_list) == 0
+        self.read_counts(counts, patch_index)
+        if patch_index is None:
+            self.model_cache.put(base, self.radius, counts, self.patch_index if empty else None)
+        if empty:
+            self.shared_index = True
+        
+    def read_shards(self, paths, workers = None, chunk_size = 1 << 20):
+        """Reads many text files, counting each in a pool of processes and merging the counts.
+        
+        With a sketch_width and a min_frequency, every file is first sketched in the pool and the 
+        sketches are merged, so that each file keeps the sub-strings frequent in the whole corpus. 
+        The merged counts are compacted once, so the model does not depend on how the corpus is split.
+        
+        Parameters
+        ----------
+        paths : list <str>
+            The paths of the text files
+        workers : int, optional
+            The number of processes, the number of CPUs if not given
+        chunk_size : int, optional
+            How many characters to read at a time
+        """
+        
+        index = self.novelty_index
+        options = (self.radius, self.padding_left, self.padding_right, self.line_delimiter, chunk_size, self.tokenizer)
+        with multiprocessing.Pool(workers) as pool:
+            sketch = None
+            if self.sketch_width > 0 and self.min_frequency > 1 and paths:
+                sketches = pool.starmap(sketch_file, [(path,) + options + (self.sketch_width, self.sketch_depth) for path in paths])
+                sketch = sketches[0]
+                for other in sketches[1:]:
+                    sketch.merge(other)
+                self.sketch_bytes = sketch.memory()
+            tasks = [(path,) + options + (index.empty() if index is not None else None, self.min_frequency, 0, self.sketch_depth, sketch)
+                     for path in paths]
+            shards = pool.starmap(count_file, tasks)
+        counts = PartialCounts(self.radius, self.padding_left, self.padding_right, self.tokenizer, index)
+        for shard in shards:
+            counts.merge(shard)
+        self.read_counts(counts)
+        
+    def count_lines(self, lines):
+        """Counts the sub-strings of lines of text, without changing the model.
+        
+        Parameters
+        ----------
+        lines : iterable <str or bytes>
+            The lines to count, without their delimiters
+        
+        Returns
+        -------
+        PartialCounts
+            The counts of the lines, which can be merged with other counts or read
+        """
+        
+        if self.sketch_width > 0 and self.min_frequency > 1 and iter(lines) is lines:
+            raise Exception("A sketched count reads the lines twice, so they can not be an iterator")
+        return self.count_source(lambda: lines)
+        
+    def count_source(self, get_lines, counts = None):
+        """Counts the sub-strings of a corpus, without changing the model.
+        
+        With a sketch_width and a min_frequency, the corpus is read twice, first into a CountMinSketch, 
+        then to count only the sub-strings it estimates to occur at least min_frequency times.
+        
+        Parameters
+        ----------
+        get_lines : function
+            Called without arguments to get the lines of the corpus, once or twice
+        counts : PartialCounts, optional
+            The counts to add to, new counts adding to novelty_index if not given
+        
+        Returns
+        -------
+        PartialCounts
+            The counts of the corpus
+        """
+        
+        if counts is None:
+            counts = PartialCounts(self.radius, self.padding_left, self.padding_right, self.tokenizer, self.novelty_index)
+        sketch = count_source(counts, get_lines, self.min_frequency, self.sketch_width, self.sketch_depth)
+        if sketch is not None:
+            self.sketch_bytes = sketch.memory()
+        return counts
+        
+    def get_counts(self):
+        """Wraps the tables of the model in a PartialCounts that shares them.
+        
+        Returns
+        -------
+        PartialCounts
+            The counts of every text read so far
+        """
+        
+        self.unpack_model()
+        counts = PartialCounts(self.radius, self.padding_left, self.padding_right, self.tokenizer, self.novelty_index)
+        counts.count_table = self.count_table
+        counts.total_table = self.total_table
+        counts.total_phonemes = self.total_phonemes
+        counts.phoneme_list = self.phoneme_list
+        counts.length_table = self.length_table
+        return counts
+        
+    def read_counts(self, counts, patch_index = None):
+        """Adds counts of sub-strings to the model, updating the Patches they change in place.
+        
+        The sub-strings rarer than min_frequency, or beyond the top_k of their central character, 
+        are dropped from the merged tables.
+        
+        Parameters
+        ----------
+        counts : PartialCounts
+            The counts to add, made with the radius, padding and tokenizer of this handler
+        patch_index : PatchIndex, optional
+            The PatchIndex built from exactly these counts, used instead of building the Patches if the model is empty
+        """
+        
+        empty = len(self.phoneme_list) == 0
+        model = self.get_counts().merge(counts)
+        self.update_model(model, counts, patch_index if empty else None)
+        for fallback in self.fallbacks:
+            fallback.read_counts(counts.at_radius(fallback.radius, False))
+        
+    def remove_text(self, text):
+        """Removes text read before from the model, updating the Patches it changes in place.
+        
         Parameters
         ----------
         text : str
-            The string to read
-        """
-        
-        #Read text into tables of text
-        words = text.split(self.line_delimiter)
-        for word in words:
-            padded_word = (self.padding_left*(self.radius+1)) + word + (self.padding_right*(self.radius+1))
-            n = len(padded_word)
-            for i in range(n - 2*self.radius):
-                patch_text = padded_word[i:i+2*self.radius+1]
-                phoneme = padded_word[i+self.radius]
-                if phoneme not in self.phoneme_list:
-                    self.phoneme_list.append(phoneme)
-                    self.count_table[phoneme] = {}
-                    self.total_table[phoneme] = 0
-                if patch_text not in self.count_table[phoneme]:
-                    self.count_table[phoneme][patch_text] = 0
-                self.count_table[phoneme][patch_text] = self.count_table[phoneme][patch_text] + 1
-                self.total_table[phoneme] = self.total_table[phoneme] + 1
-                self.total_phonemes = self.total_phonemes + 1
-        self.word_start = self.phoneme_list.index(self.padding_left)
-        self.word_end = self.phoneme_list.index(self.padding_right)
-        
-        #turn tables of text in list of Patch objects for use in Wave()
-        for phoneme in self.count_table:
-            for patch_string in self.count_table[phoneme]:
-                raw_patch = [self.phoneme_to_num(c) for c in patch_string]
-                p = Patch(self.phoneme_to_num(phoneme), raw_patch, self.radius, self.count_table[phoneme][patch_string])
-                self.patches_list.append(p)
+            The string to remove
+        """
+        
+        self.remove_lines(text.split(self.line_delimiter))
+        
+    def remove_lines(self, lines):
+        """Removes lines read before from the model, updating the Patches they change in place.
+        
+        The lines stay in novelty_index, which can not forget them.
+        
+        Parameters
+        ----------
+        lines : iterable <str or bytes>
+            The lines to remove, without their delimiters
+        """
+        
+        counts = PartialCounts(self.radius, self.padding_left, self.padding_right, self.tokenizer)
+        counts.add_lines(lines)
+        self.remove_counts(counts)
+        
+    def remove_counts(self, counts):
+        """Removes counts of sub-strings from the model, updating the Patches they change in place.
+        
+        Parameters
+        ----------
+        counts : PartialCounts
+            The counts to remove, made with the radius, padding and tokenizer of this handler
+        """
+        
+        model = self.get_counts().subtract(counts)
+        self.update_model(model, counts)
+        for fallback in self.fallbacks:
+            fallback.remove_counts(counts.at_radius(fallback.radius, False))
+        
+    def update_model(self, model, counts, patch_index = None):
+        """Compacts the tables changed by some counts, then updates the Patches of the changed sub-strings.
+        
+        The Patches are only all built when the model has none yet. The templates are updated in place 
+        by update_patches, while the BatchWaves, automaton and scorer are built again from the updated 
+        model when next needed.
+        
+        Parameters
+        ----------
+        model : PartialCounts
+            The counts of the model, from get_counts, with the counts added or removed
+        counts : PartialCounts
+            The counts that were added or removed
+        patch_index : PatchIndex, optional
+            The PatchIndex built from exactly the counts of the model, used instead of building the Patches
+        """
+        
+        dropped = {}
+        if self.min_frequency > 1 or self.top_k is not None:
+            dropped = model.compact(self.min_frequency, self.top_k, counts.phoneme_list)
+            self.dropped_windows = self.dropped_windows + len(dropped)
+        self.total_phonemes = model.total_phonemes
+        self.novelty_index = model.line_index
+        self.phoneme_ids = {phoneme : i for i, phoneme in enumerate(self.phoneme_list)}
+        self.word_start = self.phoneme_to_num(self.padding_left)
+        self.word_end = self.phoneme_to_num(self.padding_right)
+        self.automaton = None
+        self.scorer = None
+        self.batch_waves = {}
+        
+        if patch_index is not None:
+            self.patches_list = list(patch_index.patches_list)
+            self.patch_index = patch_index
+            self.shared_index = True
+        elif self.patch_index is None:
+            #turn tables of text in list of Patch objects for use in Wave()
+            ids = self.phoneme_ids
+            self.patches_list = []
+            for phoneme in self.count_table:
+                core = ids[phoneme]
+                for patch_string, frequency in self.count_table[phoneme].items():
+                    p = Patch(core, [ids[c] for c in patch_string], self.radius, frequency)
+                    self.patches_list.append(p)
+            self.patch_index = PatchIndex(self.patches_list, self.radius)
+            self.shared_index = False
+        else:
+            windows = [patch_string for phoneme in counts.phoneme_list for patch_string in counts.count_table[phoneme]]
+            self.update_patches(windows + list(dropped))
+            return
+        self.templates = {}
+        self.nogoods = {}
+        self.infeasible_lengths = set()
+        
+    def update_patches(self, windows):
+        """Updates the Patches of some sub-strings to their counts in count_table, in place.
+        
+        Patches whose count changed have their frequency changed with Patch.add_frequency, and every 
+        template is reweighed. Patches no longer counted are removed from every template, which is 
+        propogated again, giving the same super-position as compiling it again, and the templates left 
+        without a possible wave are dropped. Their identifiers are reused by the next Patches added, so 
+        the PatchIndex does not grow on a stream of updates. New Patches may allow what was culled 
+        before, so they drop every template, which the next Wave of each size compiles again.
+        
+        Parameters
+        ----------
+        windows : list <str or tuple>
+            The sub-strings that may have changed
+        """
+        
+        if self.shared_index:
+            self.patch_index = self.patch_index.copy()
+            self.patches_list = [p for p, f in zip(self.patch_index.patches_list, self.patch_index.frequencies) if f > 0]
+            self.shared_index = False
+            for template in self.templates.values():
+                for we in template:
+                    we.index = self.patch_index
+        index = self.patch_index
+        ids = self.phoneme_ids
+        added = []
+        removed = []
+        increments = {}
+        for patch_string in set(windows):
+            phoneme = patch_string[self.radius]
+            frequency = self.count_table[phoneme].get(patch_string, 0)
+            raw = tuple(ids[c] for c in patch_string)
+            i = index.ids.get(raw)
+            if i is None:
+                if frequency > 0:
+                    added.append(Patch(ids[phoneme], raw, self.radius, frequency))
+            elif frequency == 0:
+                removed.append(i)
+            elif frequency != index.frequencies[i]:
+                increments[i] = frequency - index.frequencies[i]
+        
+        if added:
+            self.templates = {}
+            self.nogoods = {}
+            self.infeasible_lengths = set()
+        if removed:
+            mask = 0
+            for i in removed:
+                mask = mask | (1 << i)
+            for key, template in list(self.templates.items()):
+                size, exact_length = key
+                wave = Wave(self.radius, size, self.word_start, self.word_end, self.patches_list, index, self.heuristic, 0,
+                            template, self.rng, exact_length, self.get_constraints(size))
+                if wave.remove_patches(mask):
+                    self.templates[key] = wave.waveform
+                else:
+                    del self.templates[key]
+                    self.nogoods.pop(key, None)
+            dead = {index.patches_list[i].raw_patch for i in removed}
+            index.remove_patches(removed)
+            self.patches_list = [p for p in self.patches_list if p.raw_patch not in dead]
+        if increments:
+            changes = {i : (increment, index.add_frequency(i, increment)) for i, increment in increments.items()}
+            for template in self.templates.values():
+                for we in template:
+                    we.reweigh(changes)
+        if added:
+            index.add_patches(added)
+            self.patches_list.extend(added)
+                
+    def memory_report(self):
+        """Reports the memory used by the model, and how much of the text read was lost by compacting it.
+        
+        Returns
+        -------
+        dict
+            "patches", the number of Patches, "dropped", the number of distinct sub-strings dropped, 
+            "coverage", the share of the sub-strings read that are still counted, and the estimated 
+            "count_bytes", "index_bytes" and "sketch_bytes" of count_table, the PatchIndex with its Patches 
+            and the last CountMinSketch, with their "total_bytes"
+        """
+        
+        counts = PartialCounts(self.radius, self.padding_left, self.padding_right, self.tokenizer)
+        counts.count_table = self.count_table
+        if isinstance(self.patches_list, PackedPatches):
+            kept = sum(self.patches_list.frequencies)
+        else:
+            kept = sum(p.frequency for p in self.patches_list)
+        report = {"patches" : len(self.patches_list),
+                  "dropped" : self.dropped_windows,
+                  "coverage" : kept/self.total_phonemes if self.total_phonemes > 0 else 1.0,
+                  "count_bytes" : counts.memory(),
+                  "index_bytes" : self.patch_index.memory() if self.patch_index is not None else 0,
+                  "sketch_bytes" : self.sketch_bytes}
+        report["total_bytes"] = report["count_bytes"] + report["index_bytes"] + report["sketch_bytes"]
+        return report
+        
+    def save_model(self, path):
+        """Saves the model read from the text, with its fallback models, to a compiled model file.
+        
+        Parameters
+        ----------
+        path : str
+            The file to write
+        """
+        
+        write_model(path, self.compile_model())
+        
+    def compile_model(self):
+        """Gathers the model and its fallback models in a CompiledModel, as save_model writes them.
+        
+        Returns
+        -------
+        CompiledModel
+            The model
+        """
+        
+        model = CompiledModel()
+        model.radius = self.radius
+        model.line_delimiter = self.line_delimiter
+        model.padding_left = self.padding_left
+        model.padding_right = self.padding_right
+        model.phoneme_list = self.phoneme_list
+        model.total_phonemes = self.total_phonemes
+        model.word_start = self.word_start
+        model.word_end = self.word_end
+        model.totals = [self.total_table[phoneme] for phoneme in self.phoneme_list]
+        model.length_table = self.length_table
+        if isinstance(self.patches_list, PackedPatches):
+            model.cores = self.patches_list.cores
+            model.raw_patches = self.patches_list.raw_patches
+            model.frequencies = self.patches_list.frequencies
+        else:
+            model.cores = [p.core for p in self.patches_list]
+            model.raw_patches = [c for p in self.patches_list for c in p.raw_patch]
+            model.frequencies = [p.frequency for p in self.patches_list]
+        model.fallbacks = [fallback.compile_model() for fallback in self.fallbacks]
+        return model
+        
+    def load_model(self, path):
+        """Replaces the model with one loaded from a compiled model file.
+        
+        The Patches stay in the memory mapped file and are only built when a Wave first 
+        needs them. The PatchIndex is built from the arrays of the file by the first Wave, 
+        without building any Patch, and count_table is only rebuilt if more text is read. The handler
+        needs the tokenizer the model was saved with, and keeps its novelty_index, which is not saved.
+        The fallback models saved with the model replace fallback_radii.
+        
+        Parameters
+        ----------
+        path : str
+            The file to read
+        """
+        
+        self.load_compiled(read_model(path))
+        
+    def load_compiled(self, model):
+        """Replaces the model, and the fallback models, with those of a CompiledModel.
+        
+        Parameters
+        ----------
+        model : CompiledModel
+            The model, from read_model
+        """
+        
+        if self.fallback_radii and not model.fallbacks:
+            raise Exception("The model file has no fallback models, save it from a handler with fallback_radii")
+        self.radius = model.radius
+        self.line_delimiter = model.line_delimiter
+        self.padding_left = model.padding_left
+        self.padding_right = model.padding_right
+        self.phoneme_list = model.phoneme_list
+        self.phoneme_ids = {phoneme : i for i, phoneme in enumerate(self.phoneme_list)}
+        self.total_phonemes = model.total_phonemes
+        self.word_start = model.word_start
+        self.word_end = model.word_end
+        self.total_table = dict(zip(model.phoneme_list, model.totals))
+        self.length_table = dict(model.length_table)
+        self.count_table = {}
+        self.patches_list = PackedPatches(model.cores, model.raw_patches, model.frequencies, model.radius)
+        self.patch_index = None
+        self.automaton = None
+        self.scorer = None
+        self.templates = {}
+        self.nogoods = {}
+        self.batch_waves = {}
+        self.infeasible_lengths = set()
+        self.wave = None
+        self.fallback_radii = [fallback.radius for fallback in model.fallbacks]
+        self.make_fallbacks()
+        for fallback, compiled in zip(self.fallbacks, model.fallbacks):
+            fallback.load_compiled(compiled)
+        
+    def unpack_model(self):
+        """Rebuilds count_table and a plain list of Patches for a model loaded from a compiled model file.
+        """
+        
+        if not isinstance(self.patches_list, PackedPatches):
+            return
+        packed = self.patches_list
+        self.count_table = {phoneme : {} for phoneme in self.phoneme_list}
+        for p in packed:
+            patch_string = self.tokenizer.join_key([self.num_to_phoneme(c) for c in p.raw_patch])
+            self.count_table[self.num_to_phoneme(p.core)][patch_string] = p.frequency
+        self.patches_list = []
+        self.patch_index = None
+        
+    def get_lengths(self):
+        """Finds the lengths of the lines read that are within min_length and max_length, and not infeasible.
+        
+        Returns
+        -------
+        list <int>
+            The lengths, in the order they were first read
+        """
+        
+        return [l for l in self.length_table if l >= self.min_length and (self.max_length is None or l <= self.max_length)
+                and l not in self.infeasible_lengths]
+    
+    def draw_length(self):
+        """Draws the length of the next Wave from the lengths of the lines read, within min_length and max_length.
+        
+        Returns
+        -------
+        int
+            The length drawn
+        """
+        
+        lengths = self.get_lengths()
+        if len(lengths) == 0:
+            raise Exception("No line lengths between min_length and max_length")
+        rng = self.rng if self.rng is not None else random
+        return rng.choices(lengths, [self.length_table[l] for l in lengths])[0]
+    
+    def make_patch_index(self):
+        """Builds the PatchIndex of patches_list, straight from its arrays for a model loaded from a compiled model file.
+        
+        Returns
+        -------
+        PatchIndex
+            The index of every Patch
+        """
+        
+        if isinstance(self.patches_list, PackedPatches):
+            return PatchIndex.from_packed(self.patches_list)
+        return PatchIndex(self.patches_list, self.radius)
+    
+    def generate_wave(self, size = None):
+        """Creates the Wave object, cloning the initial super-position compiled by the first one of its size.
+        
+        Parameters
+        ----------
+        size : int, optional
+            The length of the Wave, max_size or a length drawn by draw_length if not given
+        """
+        
+        if self.patch_index is None:
+            self.patch_index = self.make_patch_index()
+        if size is None:
+            size = self.draw_length() if self.variable_length else self.max_size
+        constraints = self.get_constraints(size)
+        if constraints is None:
+            raise Exception("The constraints do not fit in a wave of size " + str(size))
+        key = (size, self.variable_length)
+        self.wave = Wave(self.radius, size, self.word_start, self.word_end, self.patches_list, self.patch_index,
+                         self.heuristic, self.max_backtracks, self.templates.get(key), self.rng, self.variable_length,
+                         constraints, self.stats, self.get_nogoods(key))
+        self.templates[key] = self.wave.template
+        
+    def collapse_fallback(self):
+        """Completes the last Wave, which failed, with the fallback models from the highest radius down.
+        
+        The cores decided away from the contradiction are pinned in a Wave of the same size of the 
+        next fallback model, which decides the rest. If it fails too, its own cores away from its 
+        contradiction are carried over to the next one.
+        
+        Returns
+        -------
+        tuple (list <int>, int, int)
+            The cores of the wave as values of this model, the radius of the fallback model that completed it, 
+            and the number of positions not decided by this model, or None if every fallback model failed
+        """
+        
+        size = self.wave.max_size
+        key = (size, self.variable_length)
+        pins = {position : self.phoneme_list[c] for position, c in self.wave.kept_cores().items()}
+        strict = set(pins)
+        for fallback in self.fallbacks:
+            constraints = fallback.get_constraints(size)
+            if constraints is None:
+                continue
+            if fallback.patch_index is None:
+                fallback.patch_index = fallback.make_patch_index()
+            if self.stats is not None:
+                self.stats.count("fallbacks")
+            wave = Wave(fallback.radius, size, fallback.word_start, fallback.word_end, fallback.patches_list,
+                        fallback.patch_index, self.heuristic, self.max_backtracks, fallback.templates.get(key), self.rng,
+                        self.variable_length, constraints, self.stats)
+            fallback.templates[key] = wave.template
+            ids = fallback.phoneme_ids
+            pinned = {position : ids[phoneme] for position, phoneme in pins.items() if phoneme in ids}
+            if wave.pin(pinned) and wave.collapse():
+                cores = [self.phoneme_ids[fallback.phoneme_list[we.selected_core]] for we in wave.waveform]
+                return cores, fallback.radius, size - len(strict & set(pinned))
+            kept = wave.kept_cores()
+            pins = {position : fallback.phoneme_list[c] for position, c in kept.items()}
+            strict = strict & set(kept)
+        return None
+        
+    def get_nogoods(self, key):
+        """Finds the contradictions learned for one template, creating the store if needed.
+        
+        Parameters
+        ----------
+        key : tuple
+            The (size, exact_length) of the template
+        
+        Returns
+        -------
+        NogoodStore
+            The store of the template, or None if max_nogoods is 0
+        """
+        
+        if self.max_nogoods <= 0:
+            return None
+        if key not in self.nogoods:
+            self.nogoods[key] = NogoodStore(self.max_nogoods, self.nogood_size)
+        return self.nogoods[key]
+        
+    def compile_templates(self):
+        """Compiles the initial super-position of every size of Wave that may be generated.
+        
+        With the automaton engine, the completions of every size are counted instead.
+        """
+        
+        if self.variable_length:
+            sizes = self.get_lengths()
+        else:
+            sizes = [self.max_size]
+        for size in sizes:
+            if (size, self.variable_length) in self.templates or size in self.infeasible_lengths:
+                continue
+            constraints = self.get_constraints(size)
+            if constraints is None:
+                self.infeasible_lengths.add(size)
+                continue
+            if self.engine == "automaton":
+                if not self.get_automaton().is_feasible(size, constraints, self.variable_length):
+                    self.infeasible_lengths.add(size)
+                continue
+            self.generate_wave(size)
+            if self.wave.check_failed_collapse():
+                self.infeasible_lengths.add(size)
                 
-    def generate_wave(self):
-        """Creates the Wave object.
+    def set_constraints(self, prefix = None, suffix = None, positions = None):
+        """Restricts the characters allowed at some positions of the text produced.
+        
+        Every size of Wave that may be generated is compiled and propogated with the constraints 
+        right away, so impossible constraints are rejected before any attempt is made.
+        
+        Parameters
+        ----------
+        prefix : str or list <str>, optional
+            The characters the text must start with, split into phonemes by the tokenizer if a str
+        suffix : str or list <str>, optional
+            The characters the text must end with, which fills the wave to its end, split like prefix
+        positions : dict {<int> : str or iterable <str>}, optional
+            The character, or set of characters, allowed at each position, negative positions counting from the end
+        """
+        
+        constraints = {}
+        pins = []
+        if positions is not None:
+            pins.extend(positions.items())
+        if isinstance(prefix, str):
+            prefix = self.tokenizer.phonemes(prefix)
+        if isinstance(suffix, str):
+            suffix = self.tokenizer.phonemes(suffix)
+        if prefix is not None:
+            pins.extend(enumerate(prefix))
+        if suffix is not None:
+            pins.extend((i - len(suffix), phoneme) for i, phoneme in enumerate(suffix))
+        for position, phonemes in pins:
+            allowed = {phonemes} if isinstance(phonemes, str) else set(phonemes)
+            constraints[position] = constraints[position] & allowed if position in constraints else allowed
+        
+        self.constraints = constraints
+        self.templates = {}
+        self.nogoods = {}
+        self.batch_waves = {}
+        self.infeasible_lengths = set()
+        for fallback in self.fallbacks:
+            fallback.clear_constraints()
+            fallback.constraints = constraints
+        if not self.check_constraints():
+            self.clear_constraints()
+            raise Exception("The constraints can not be satisfied")
+            
+    def clear_constraints(self):
+        """Removes every constraint on the text produced.
+        """
+        
+        self.constraints = {}
+        self.templates = {}
+        self.nogoods = {}
+        self.batch_waves = {}
+        self.infeasible_lengths = set()
+        for fallback in self.fallbacks:
+            fallback.clear_constraints()
+        
+    def check_constraints(self):
+        """Compiles every size of Wave that may be generated, and checks that one is possible under the constraints.
+        
+        Returns
+        -------
+        bool
+            If at least one size of Wave is possible
+        """
+        
+        self.compile_templates()
+        if self.variable_length:
+            return len(self.get_lengths()) > 0
+        return self.max_size not in self.infeasible_lengths
+    
+    def get_constraints(self, size):
+        """Converts the constraints to the cores allowed at each position of a Wave.
+        
+        Parameters
+        ----------
+        size : int
+            The length of the Wave
+        
+        Returns
+        -------
+        dict {<int> : set <int>}
+            The cores allowed at each constrained position, or None if a position is outside of the Wave
+        """
+        
+        constraints = {}
+        for position, phonemes in self.constraints.items():
+            i = position if position >= 0 else size + position
+            if i < 0 or i >= size:
+                return None
+            allowed = {self.phoneme_ids[phoneme] for phoneme in phonemes if phoneme in self.phoneme_ids}
+            constraints[i] = constraints[i] & allowed if i in constraints else allowed
+        return constraints
+
+    def instrument(self, enabled = True):
+        """Starts or stops counting and timing the collapses of each production.
+        
+        The stats are cleared at the start of every call to iter_produce, produce_batch, 
+        produce_parallel or produce, and hooks can be added to them with CollapseStats.add_hook.
+        
+        Parameters
+        ----------
+        enabled : bool, optional
+            False to stop instrumenting
+        
+        Returns
+        -------
+        CollapseStats
+            The stats that will be collected, or None if disabled
+        """
+        
+        if not enabled:
+            self.stats = None
+        elif self.stats is None:
+            self.stats = CollapseStats()
+        return self.stats
+        
+    def get_automaton(self):
+        """Finds the PatchAutomaton of the model, compiling it if needed.
+        
+        Returns
+        -------
+        PatchAutomaton
+            The automaton compiled from patches_list
+        """
+        
+        if self.automaton is None:
+            self.automaton = PatchAutomaton(self.patches_list, self.radius, self.word_start, self.word_end)
+        return self.automaton
+        
+    def sample_automaton(self, size = None):
+        """Samples the cores of a valid wave from the PatchAutomaton, in a single pass that never fails.
+        
+        Parameters
+        ----------
+        size : int, optional
+            The length of the wave, max_size or a length drawn by draw_length if not given
+        
+        Returns
+        -------
+        list <int>
+            The cores of the whole wave, or None if no valid wave exists
+        """
+        
+        if size is None:
+            size = self.draw_length() if self.variable_length else self.max_size
+        constraints = self.get_constraints(size)
+        if constraints is None:
+            raise Exception("The constraints do not fit in a wave of size " + str(size))
+        rng = self.rng if self.rng is not None else random
+        return self.get_automaton().sample(rng, size, constraints, self.variable_length)
+        
+    def get_scorer(self):
+        """Finds the PatchScorer of the model, building it if needed.
+        
+        Returns
+        -------
+        PatchScorer
+            The scorer of the Patches of patch_index
+        """
+        
+        if self.scorer is None:
+            if self.patch_index is None:
+                self.patch_index = self.make_patch_index()
+            self.scorer = PatchScorer(self.patch_index)
+        return self.scorer
+        
+    def score(self, strings, batch_size = 1 << 16):
+        """Checks if every sub-string of strings is a Patch of the model, and how likely they are, without collapsing any Wave.
+        
+        Each string is split and padded the same way read_text does, then each of its sub-strings is looked 
+        up in the PatchScorer, batch_size strings at a time. This is stricter than a Wave, which only checks 
+        the cores of a Patch one slot at a time, so strings produced may still not be valid.
+        
+        Parameters
+        ----------
+        strings : iterable <str>
+            The strings to score
+        batch_size : int, optional
+            How many strings to score at a time
+        
+        Returns
+        -------
+        tuple (list <bool>, list <float>)
+            If every sub-string of each string is a Patch, and the log-likelihood of each string 
+            under the (2*radius+1)-gram model of the Patches, -inf if it is not valid
+        """
+        
+        scorer = self.get_scorer()
+        ids = self.phoneme_ids
+        left = [self.word_start]*(self.radius + 1)
+        right = [self.word_end]*(self.radius + 1)
+        valid = []
+        totals = []
+        batch = []
+        for text in strings:
+            batch.append(left + [ids.get(phoneme, -1) for phoneme in self.tokenizer.phonemes(text)] + right)
+            if len(batch) == batch_size:
+                v, t = scorer.score(batch)
+                valid.extend(v)
+                totals.extend(t)
+                batch = []
+        if batch:
+            v, t = scorer.score(batch)
+            valid.extend(v)
+            totals.extend(t)
+        return valid, totals
+        
+    def get_batch_wave(self, size = None):
+        """Finds the BatchWave of a size of Wave, creating it from the template of that size if needed.
+        
+        Parameters
+        ----------
+        size : int, optional
+            The length of the Wave, max_size if not given
+        
+        Returns
+        -------
+        BatchWave
+            The batch of Waves of that size
         """
         
-        self.wave = Wave(self.radius, self.max_size, self.word_start, self.word_end, self.patches_list)
+        if size is None:
+            size = self.max_size
+        if size not in self.batch_waves:
+            self.generate_wave(size)
+            self.batch_waves[size] = BatchWave(self.patch_index, self.wave.template, self.batch_size,
+                                               self.rng if self.rng is not None else random, self.heuristic,
+                                               self.max_backtracks)
+        return self.batch_waves[size]
+        
+    def cores_to_text(self, cores):
+        """Converts the cores of a wave to text, without its padding.
+        
+        Parameters
+        ----------
+        cores : list <int>
+            The core of every element of the wave
+        
+        Returns
+        -------
+        str
+            The text of the wave
+        """
+        
+        phonemes = self.phoneme_list
+        out = self.tokenizer.join([phonemes[c] for c in cores])
+        return out.strip(self.padding_left + self.padding_right)
+        
+    def cores_to_key(self, cores):
+        """Converts the cores of a wave to the key of its line in novelty_index, without its padding.
+        
+        Parameters
+        ----------
+        cores : list <int>
+            The core of every element of the wave
+        
+        Returns
+        -------
+        str or tuple <str>
+            The key of the line, as made by the tokenizer
+        """
+        
+        start = 0
+        end = len(cores)
+        while start < end and cores[start] == self.word_start:
+            start = start + 1
+        while end > start and cores[end - 1] == self.word_end:
+            end = end - 1
+        phonemes = self.phoneme_list
+        return self.tokenizer.join_key([phonemes[c] for c in cores[start:end]])
+        
+    def is_known(self, text):
+        """Checks if a string is one of the lines read, according to novelty_index.
+        
+        Parameters
+        ----------
+        text : str
+            The string to check
+        
+        Returns
+        -------
+        bool
+            If the string was read, always False without a novelty_index
+        """
+        
+        if self.novelty_index is None:
+            return False
+        return self.tokenizer.key(self.tokenizer.split(text)) in self.novelty_index
+        
+    def wave_to_text(self):
+        """Converts the collapsed wave to text, without its padding.
+        
+        Returns
+        -------
+        str
+            The text of the collapsed wave
+        """
+        
+        return self.cores_to_text([we.selected_core for we in self.wave.waveform])
 
     def print_wave_raw(self):
         """Prints the contents of the collapsed wave as text.
         """
         
-        out = ""
-        for we in self.wave.waveform:
-            out = out + self.num_to_phoneme(we.selected_core)
-        
-        print(out.strip("+-"))
+        print(self.wave_to_text())
         
     def mid_print(self):
         """Prints some contents of the wave function while it isn't collapsed.
@@ -153,8 +1260,154 @@ class TextWaveHandler:
             out = out + var + "\n"
         print(out)
 
+    def iter_produce(self, n = None, max_out = 2000):
+        """Lazily produces random strings from the wave function collapse.
+        
+        Strings found in novelty_index, or already produced by this call if unique is set, 
+        are rejected like failed attempts. With the wave engine, a failed Wave is completed 
+        by the fallback models if there are any, and the result tells how much it needed them.
+        With variable_length, the batch engine produces like the wave engine, so that every 
+        drawn length gets one attempt rather than a whole batch of them.
+        
+        Parameters
+        ----------
+        n : int, optional
+            The number of random strings to produce, or None to keep producing
+        max_out : int, optional
+            The maximum number of attempts to make before ending prematurely
+        
+        Yields
+        ------
+        ProductionResult
+            Each string produced, and finally a result with no text if max_out ran out
+        """
+        
+        if self.constraints and not self.check_constraints():
+            raise Exception("The constraints can not be satisfied")
+        
+        stats = self.stats
+        if stats is not None:
+            stats.reset()
+        novelty_index = self.novelty_index
+        check = novelty_index is not None or self.unique
+        seen = set()
+        i = 0
+        attempts = 0
+        start = time.perf_counter()
+        while n is None or i < n:
+            max_out = max_out - 1
+            if max_out < 0:
+                yield ProductionResult(None, attempts, time.perf_counter() - start, True)
+                return
+            attempts = attempts + 1
+            radius = self.radius
+            fallback = 0
+            if self.engine == "automaton":
+                cores = self.sample_automaton()
+            elif self.engine == "batch" and not self.variable_length:
+                cores = self.get_batch_wave().next_attempt()
+            else:
+                self.generate_wave()
+                cores = None
+                if self.wave.collapse():
+                    cores = [we.selected_core for we in self.wave.waveform]
+                elif self.fallbacks:
+                    completed = self.collapse_fallback()
+                    if completed is not None:
+                        cores, radius, fallback = completed
+            rejected = None
+            if check and cores is not None:
+                key = self.cores_to_key(cores)
+                if novelty_index is not None and key in novelty_index:
+                    rejected = "known"
+                elif self.unique:
+                    if key in seen:
+                        rejected = "duplicates"
+                    seen.add(key)
+            if stats is not None:
+                stats.emit("attempt", success=cores is not None and rejected is None)
+                if cores is None:
+                    stats.count("restarts")
+                elif rejected is not None:
+                    stats.count(rejected)
+            if cores is not None and rejected is None:
+                text = self.cores_to_text(cores)
+                if stats is not None:
+                    stats.emit("produce", text=text, attempts=attempts)
+                yield ProductionResult(text, attempts, time.perf_counter() - start, False, radius, fallback)
+                i = i+1
+                attempts = 0
+                start = time.perf_counter()
+                
+    def produce_batch(self, n, max_out = 2000):
+        """Produces a list of random strings from the wave function collapse.
+        
+        Parameters
+        ----------
+        n : int
+            The number of random strings to produce
+        max_out : int, optional
+            The maximum number of attempts to make before ending prematurely
+        
+        Returns
+        -------
+        list <ProductionResult>
+            Each string produced, ending with a result with no text if max_out ran out
+        """
+        
+        return list(self.iter_produce(n, max_out))
+
+    def produce_parallel(self, n, workers = None, seed = None, max_out = 2000, chunk_size = 100):
+        """Produces random strings from the wave function collapse over a pool of processes.
+        
+        The strings are split into chunks of chunk_size, each produced from its own random.Random 
+        seeded from the master seed, so the results only depend on seed and chunk_size.
+        Each worker receives the model once, by fork where the platform allows it.
+        If the handler is instrumented, the stats of every chunk are merged, but hooks run in the workers.
+        
+        Parameters
+        ----------
+        n : int
+            The number of random strings to produce
+        workers : int, optional
+            The number of processes, the number of CPUs if not given
+        seed : int, optional
+            The master seed, random if not given
+        max_out : int, optional
+            The maximum number of attempts to make for each chunk before ending it prematurely
+        chunk_size : int, optional
+            The number of strings produced by each task
+        
+        Returns
+        -------
+        list <ProductionResult>
+            Each string produced, in chunk order, with a result with no text for each chunk that maxed out
+        """
+        
+        master = random.Random(seed)
+        tasks = []
+        for i in range(0, n, chunk_size):
+            tasks.append((min(chunk_size, n - i), max_out, master.getrandbits(64)))
+        
+        #Compile the templates before the workers start, so that they all share them
+        self.compile_templates()
+        
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        if self.stats is not None:
+            self.stats.reset()
+        results = []
+        with context.Pool(workers, _init_worker, (self,)) as pool:
+            for chunk, stats in pool.imap(_produce_chunk, tasks):
+                results.extend(chunk)
+                if stats is not None:
+                    self.stats.merge(stats)
+        return results
+
     def produce(self, n, max_out = 2000):
-        """Produces random strings from the wave function collapse.
+        """Prints random strings from the wave function collapse.
         
         Parameters
         ----------
@@ -166,18 +1419,16 @@ class TextWaveHandler:
         Returns
         -------
         int
-            The converted value
+            The number of strings produced
         """
         
-        i = 0
-        while i < n:
-            max_out = max_out - 1
-            if max_out < 0:
+        produced = 0
+        for result in self.iter_produce(n, max_out):
+            if result.maxed_out:
                 print("maxed out production loops")
-                break
-            self.generate_wave()
-            success = self.wave.collapse()
-            if success:
-                self.print_wave_raw()
-                i = i+1
-            
\ No newline at end of file
+                if self.stats is not None:
+                    print(self.stats.to_json())
+            else:
+                print(result.text)
+                produced = produced + 1
+        return produced
\ No newline at end of file
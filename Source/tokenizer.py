@@ -0,0 +1,220 @@
+class CharTokenizer:
+    """Splits lines of text into single characters, the default phonemes of a TextWaveHandler.
+
+    Every tokenizer splits a line into a sliceable sequence of tokens, so that the
+    sub-strings of a line are counted by slicing, then turns each distinct sub-string
+    into the key counted in PartialCounts, whose elements are the phoneme strings.
+    """
+
+    def split(self, line):
+        """Splits a line into its tokens.
+
+        Parameters
+        ----------
+        line : str
+            The line to split, without its delimiter
+
+        Returns
+        -------
+        str
+            The line itself, as its characters are its tokens
+        """
+
+        return line
+
+    def pad(self, padding, n):
+        """Builds n padding tokens, of the same type as the result of split.
+
+        Parameters
+        ----------
+        padding : str
+            The padding phoneme
+        n : int
+            How many tokens to build
+
+        Returns
+        -------
+        str
+            The padding tokens
+        """
+
+        return padding*n
+
+    def key(self, window):
+        """Converts a sub-string of a split line to the key it is counted by.
+
+        Parameters
+        ----------
+        window : str
+            The sub-string
+
+        Returns
+        -------
+        str
+            The key of the sub-string
+        """
+
+        return window
+
+    def join_key(self, phonemes):
+        """Builds the key of a sub-string from its phonemes.
+
+        Parameters
+        ----------
+        phonemes : list <str>
+            The phoneme of each element of the sub-string
+
+        Returns
+        -------
+        str
+            The key of the sub-string
+        """
+
+        return "".join(phonemes)
+
+    def phonemes(self, text):
+        """Splits text into the phonemes counted for it.
+
+        Parameters
+        ----------
+        text : str
+            The text to split
+
+        Returns
+        -------
+        list <str>
+            The phonemes of the text
+        """
+
+        return list(self.key(self.split(text)))
+
+    def join(self, phonemes):
+        """Joins phonemes into text.
+
+        Parameters
+        ----------
+        phonemes : list <str>
+            The phonemes to join
+
+        Returns
+        -------
+        str
+            The text of the phonemes
+        """
+
+        return "".join(phonemes)
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.__dict__ == other.__dict__
+
+    def __hash__(self):
+        #Equal tokenizers have the same type, and the trie of a TrieTokenizer can not be hashed
+        return hash(type(self))
+
+class ByteTokenizer(CharTokenizer):
+    """Splits lines of bytes into single bytes, using the 256 bytes as phonemes.
+
+    Lines are never decoded. Only each distinct sub-string counted is converted to a
+    string, by latin-1, so that each byte is the phoneme of the same code point and the
+    tables keep the layout of CharTokenizer. Text produced is decoded as encoding.
+
+    Attributes
+    ----------
+    encoding : str
+        The encoding of the text, used to decode the bytes produced
+    """
+
+    def __init__(self, encoding = "utf-8"):
+        """
+        Parameters
+        ----------
+        encoding : str, optional
+        """
+
+        self.encoding = encoding
+
+    def split(self, line):
+        """Splits a line into its bytes.
+
+        Parameters
+        ----------
+        line : bytes or str
+            The line to split, without its delimiter, encoded if it is a str
+
+        Returns
+        -------
+        bytes
+            The bytes of the line
+        """
+
+        if isinstance(line, str):
+            return line.encode(self.encoding)
+        return bytes(line)
+
+    def pad(self, padding, n):
+        return padding.encode("latin-1")*n
+
+    def key(self, window):
+        return window.decode("latin-1")
+
+    def join(self, phonemes):
+        return "".join(phonemes).encode("latin-1").decode(self.encoding, errors="replace")
+
+class TrieTokenizer(CharTokenizer):
+    """Splits lines of text into the longest known tokens, such as syllables, or single characters.
+
+    Attributes
+    ----------
+    trie : dict
+        Nested dictionaries of the characters of every token, where the key None marks the end of a token
+    """
+
+    def __init__(self, tokens):
+        """
+        Parameters
+        ----------
+        tokens : iterable <str>
+            The multi-character tokens to recognize
+        """
+
+        self.trie = {}
+        for token in tokens:
+            node = self.trie
+            for c in token:
+                node = node.setdefault(c, {})
+            node[None] = token
+
+    def split(self, line):
+        """Splits a line into its tokens, taking the longest token that matches at each position.
+
+        Parameters
+        ----------
+        line : str
+            The line to split, without its delimiter
+
+        Returns
+        -------
+        tuple <str>
+            The tokens of the line
+        """
+
+        tokens = []
+        i = 0
+        while i < len(line):
+            node = self.trie
+            token = line[i]
+            j = i
+            while j < len(line) and line[j] in node:
+                node = node[line[j]]
+                j = j + 1
+                if None in node:
+                    token = node[None]
+            tokens.append(token)
+            i = i + len(token)
+        return tuple(tokens)
+
+    def pad(self, padding, n):
+        return (padding,)*n
+
+    def join_key(self, phonemes):
+        return tuple(phonemes)
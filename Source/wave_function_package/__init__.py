@@ -1,3 +1,11 @@
 from wave_function_package.patch import Patch
+from wave_function_package.patch_index import PatchIndex
+from wave_function_package.packed_patches import PackedPatches
 from wave_function_package.wave_element import WaveElement
-from wave_function_package.wave import Wave
\ No newline at end of file
+from wave_function_package.trail import Trail
+from wave_function_package.collapse_stats import CollapseStats
+from wave_function_package.nogood_store import NogoodStore
+from wave_function_package.wave import Wave
+from wave_function_package.patch_automaton import PatchAutomaton
+from wave_function_package.patch_scorer import PatchScorer
+from wave_function_package.batch_wave import BatchWave
\ No newline at end of file
@@ -0,0 +1,350 @@
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class BatchWave:
+    """Collapses many Waves of the same size at once, as NumPy arrays.
+
+    The super-positions of every Wave are a boolean array of [wave, position, Patch].
+    Each step collapses the lowest entropy position of every Wave, then culls the
+    neighbors of every changed position against the cores possible around them until
+    nothing changes, as array operations over the whole batch. Waves that finish or
+    fail are replaced by a fresh copy of the template, so the batch always stays full.
+
+    Attributes
+    ----------
+    radius : int
+        The radius of the Patches
+    size : int
+        The number of positions in each Wave, including the fixed ends
+    heuristic : str
+        How the quality of a position is measured, "entropy" or "normalization"
+    order : numpy.ndarray
+        The identifier in the PatchIndex of each Patch of the batch, which sorts them by core
+    raw : numpy.ndarray
+        The sub-string of each Patch, of shape [Patch, 2*radius+1]
+    patch_cores : numpy.ndarray
+        The core of each Patch
+    frequencies : numpy.ndarray
+        The frequency of each Patch
+    weight_logs : numpy.ndarray
+        The frequency*log(frequency) of each Patch
+    n_cores : int
+        The number of core values
+    core_starts : numpy.ndarray
+        The index of the first Patch of each core used by a Patch
+    core_values : numpy.ndarray
+        The core of the Patches starting at each of core_starts
+    template : tuple <numpy.ndarray>
+        The live, collapsed, selected, cores, weights and sums of the template
+    live : numpy.ndarray
+        The Patches possible at each position of each Wave
+    collapsed : numpy.ndarray
+        The collapsed positions of each Wave
+    selected : numpy.ndarray
+        The core of each collapsed position of each Wave
+    cores : numpy.ndarray
+        The cores possible at each position of each Wave, of shape [wave, position, core]
+    weights : numpy.ndarray
+        The weighted number of Patches possible at each position of each Wave
+    sums : numpy.ndarray
+        The sum of w*log(w) over the Patches possible at each position of each Wave
+    fresh : numpy.ndarray
+        The Waves that have not made their first, random, collapse yet
+    max_backtracks : int
+        How many times each Wave may undo a failed collapse before it is given up
+    backtracks : numpy.ndarray
+        How many failed collapses each Wave has undone
+    finished : deque <numpy.ndarray>
+        The cores of each Wave finished and not yet returned, None for each one that failed
+    rng : numpy.random.Generator
+        The source of randomness for every choice made by the batch
+    """
+
+    def __init__(self, patch_index, template, batch_size = 64, rng = None, heuristic = "entropy", max_backtracks = 0):
+        """
+        Parameters
+        ----------
+        patch_index : PatchIndex
+            The index of every Patch of the model
+        template : list <WaveElement>
+            The template of a Wave, compiled with the same PatchIndex
+        batch_size : int, optional
+            The number of Waves collapsed at once
+        rng : random.Random, optional
+            The source of the seed of the batch, a random seed if not given
+        heuristic : str, optional
+            How the quality of a position is measured, "entropy" or "normalization"
+        max_backtracks : int, optional
+            How many times each Wave may undo a failed collapse before it is given up
+        """
+
+        if np is None:
+            raise ImportError("The batch engine needs numpy, which is not installed")
+        if heuristic not in ("entropy", "normalization"):
+            raise Exception("Unknown collapse heuristic : " + str(heuristic))
+        self.radius = patch_index.radius
+        self.size = len(template)
+        self.heuristic = heuristic
+        n_patches = len(patch_index.patch_cores)
+        #Patches of the same core are kept next to each other, so the cores possible are found by reduceat
+        self.order = np.argsort(np.array(patch_index.patch_cores, dtype=np.int64), kind="stable")
+        raw = np.array([p.raw_patch for p in patch_index.patches_list], dtype=np.int64).reshape(n_patches, patch_index.length)
+        self.raw = raw[self.order]
+        self.patch_cores = np.array(patch_index.patch_cores, dtype=np.int64)[self.order]
+        self.frequencies = np.array(patch_index.frequencies, dtype=np.float64)[self.order]
+        self.weight_logs = np.array(patch_index.weight_logs, dtype=np.float64)[self.order]
+        self.n_cores = int(self.raw.max()) + 1 if n_patches > 0 else 1
+        self.core_starts = np.nonzero(np.diff(self.patch_cores, prepend=-1))[0]
+        self.core_values = self.patch_cores[self.core_starts]
+
+        n_bytes = (n_patches + 7)//8
+        self.live = np.zeros((1, self.size, n_patches), dtype=bool)
+        self.collapsed = np.zeros((1, self.size), dtype=bool)
+        self.selected = np.full((1, self.size), -1, dtype=np.int64)
+        for i, we in enumerate(template):
+            if we.collapsed:
+                self.collapsed[0, i] = True
+                self.selected[0, i] = we.selected_core
+            else:
+                bits = np.frombuffer(we.live.to_bytes(n_bytes, "little"), dtype=np.uint8)
+                self.live[0, i] = np.unpackbits(bits, bitorder="little")[:n_patches].astype(bool)[self.order]
+        self.cores = np.zeros((1, self.size, self.n_cores), dtype=bool)
+        self.weights = np.zeros((1, self.size))
+        self.sums = np.zeros((1, self.size))
+        self.refresh(np.zeros(self.size, dtype=np.int64), np.arange(self.size))
+        self.template = (self.live[0], self.collapsed[0], self.selected[0], self.cores[0], self.weights[0], self.sums[0])
+
+        seed = rng.getrandbits(64) if rng is not None else None
+        self.rng = np.random.default_rng(seed)
+        self.live, self.collapsed, self.selected, self.cores, self.weights, self.sums = [
+            np.repeat(a[None], batch_size, axis=0) for a in self.template]
+        self.fresh = np.ones(batch_size, dtype=bool)
+        self.max_backtracks = max_backtracks
+        self.backtracks = np.zeros(batch_size, dtype=np.int64)
+        self.finished = deque()
+
+    def refresh(self, waves, positions):
+        """Recomputes the cores and weights possible at some positions after their Patches changed.
+
+        Parameters
+        ----------
+        waves : numpy.ndarray
+            The Wave of each position
+        positions : numpy.ndarray
+            The index of each position in its Wave
+        """
+
+        live = self.live[waves, positions]
+        cores = np.zeros((len(waves), self.n_cores), dtype=bool)
+        if live.shape[1] > 0:
+            cores[:, self.core_values] = np.logical_or.reduceat(live, self.core_starts, axis=1)
+        collapsed = self.collapsed[waves, positions]
+        cores[collapsed] = False
+        cores[collapsed, self.selected[waves, positions][collapsed]] = True
+        self.cores[waves, positions] = cores
+        self.weights[waves, positions] = live @ self.frequencies
+        self.sums[waves, positions] = live @ self.weight_logs
+
+    def neighbors(self, waves, positions):
+        """Finds the uncollapsed positions within radius of some positions, each once.
+
+        Parameters
+        ----------
+        waves : numpy.ndarray
+            The Wave of each position
+        positions : numpy.ndarray
+            The index of each position in its Wave
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            The Wave and index of each neighbor
+        """
+
+        offsets = np.array([d for d in range(-self.radius, self.radius + 1) if d != 0], dtype=np.int64)
+        around = (positions[:, None] + offsets[None, :]).ravel()
+        waves = np.repeat(waves, len(offsets))
+        inside = (around >= 0) & (around < self.size)
+        flat = np.unique(waves[inside]*self.size + around[inside])
+        waves, positions = flat // self.size, flat % self.size
+        uncollapsed = ~self.collapsed[waves, positions]
+        return waves[uncollapsed], positions[uncollapsed]
+
+    def propogate(self, waves, positions, log = None):
+        """Culls the neighbors of changed positions until no position changes.
+
+        Parameters
+        ----------
+        waves : numpy.ndarray
+            The Wave of each changed position
+        positions : numpy.ndarray
+            The index of each changed position in its Wave
+        log : list <tuple>, optional
+            Where to append the Wave, index and previous Patches of every position culled
+        """
+
+        waves, positions = self.neighbors(waves, positions)
+        while len(waves) > 0:
+            previous = self.live[waves, positions]
+            #Only the Patches still possible somewhere need checking
+            columns = np.nonzero(previous.any(axis=0))[0]
+            checked = previous[:, columns]
+            for slot in range(2*self.radius + 1):
+                offset = slot - self.radius
+                if offset == 0:
+                    continue
+                around = positions + offset
+                inside = (around >= 0) & (around < self.size)
+                #Whether the core each Patch needs at this slot is possible at the neighbor
+                needed = self.cores[waves, np.clip(around, 0, self.size - 1)][:, self.raw[columns, slot]]
+                checked &= needed | ~inside[:, None]
+            keep = previous.copy()
+            keep[:, columns] = checked
+            changed = (checked != previous[:, columns]).any(axis=1)
+            waves, positions, keep = waves[changed], positions[changed], keep[changed]
+            if log is not None:
+                log.append((waves, positions, self.live[waves, positions]))
+            self.live[waves, positions] = keep
+            self.refresh(waves, positions)
+            waves, positions = self.neighbors(waves, positions)
+
+    def select_positions(self):
+        """Finds the position each Wave should collapse next, random for fresh Waves.
+
+        Returns
+        -------
+        numpy.ndarray
+            The position of each Wave, -1 for Waves with every position collapsed
+        """
+
+        open_positions = ~self.collapsed
+        if self.heuristic == "entropy":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                quality = np.log(self.weights) - self.sums/self.weights
+        else:
+            quality = self.weights.copy()
+        #Ties are broken randomly, and fresh Waves choose uniformly
+        noise = self.rng.random(quality.shape)
+        quality = np.where(self.fresh[:, None], noise, quality + 1e-9*noise)
+        quality = np.where(open_positions, quality, np.inf)
+        positions = np.argmin(quality, axis=1)
+        positions[~open_positions.any(axis=1)] = -1
+        self.fresh[:] = False
+        return positions
+
+    def collapse_positions(self, waves, positions):
+        """Collapses one position of some Waves via probability, weighted to each Patch by its frequency.
+
+        Parameters
+        ----------
+        waves : numpy.ndarray
+            The Waves to collapse
+        positions : numpy.ndarray
+            The position to collapse in each Wave
+        """
+
+        totals = np.cumsum(self.live[waves, positions]*self.frequencies, axis=1)
+        countdown = self.rng.random(len(waves))*totals[:, -1]
+        chosen = np.minimum((totals <= countdown[:, None]).sum(axis=1), totals.shape[1] - 1)
+        self.collapsed[waves, positions] = True
+        self.selected[waves, positions] = self.patch_cores[chosen]
+        self.live[waves, positions] = False
+        self.refresh(waves, positions)
+
+    def reset(self, waves):
+        """Replaces Waves with fresh copies of the template.
+
+        Parameters
+        ----------
+        waves : numpy.ndarray
+            The indices of the Waves to replace
+        """
+
+        for array, value in zip((self.live, self.collapsed, self.selected, self.cores, self.weights, self.sums), self.template):
+            array[waves] = value
+        self.fresh[waves] = True
+        self.backtracks[waves] = 0
+
+    def find_failed(self):
+        """Finds the Waves left with an uncollapsed position without possible Patches.
+
+        Returns
+        -------
+        numpy.ndarray
+            If each Wave failed
+        """
+
+        return (~self.collapsed & ~self.cores.any(axis=2)).any(axis=1)
+
+    def backtrack(self, waves, positions, log):
+        """Undoes the last collapse of some Waves, and bans the core it chose instead.
+
+        Parameters
+        ----------
+        waves : numpy.ndarray
+            The Waves to restore, in increasing order
+        positions : numpy.ndarray
+            The position collapsed in each Wave
+        log : list <tuple>
+            The positions collapsed and culled since the collapse, with their previous Patches
+        """
+
+        restore = np.zeros(len(self.live), dtype=bool)
+        restore[waves] = True
+        for culled, indices, previous in reversed(log[1:]):
+            keep = restore[culled]
+            self.live[culled[keep], indices[keep]] = previous[keep]
+            self.refresh(culled[keep], indices[keep])
+        cores = self.selected[waves, positions]
+        self.collapsed[waves, positions] = False
+        self.selected[waves, positions] = -1
+        self.live[waves, positions] = log[0][2][restore[log[0][0]]] & (self.patch_cores[None, :] != cores[:, None])
+        self.refresh(waves, positions)
+        self.backtracks[waves] = self.backtracks[waves] + 1
+        self.propogate(waves, positions)
+
+    def step(self):
+        """Collapses one position of every Wave and propogates, then replaces the Waves that finished or failed.
+
+        A Wave whose collapse failed, and that has backtracks left, is restored to before the
+        collapse with the chosen core banned at that position instead.
+        """
+
+        failed = self.find_failed()
+        positions = self.select_positions()
+        waves = np.nonzero((positions >= 0) & ~failed)[0]
+        if len(waves) > 0:
+            log = [(waves, positions[waves], self.live[waves, positions[waves]])]
+            self.collapse_positions(waves, positions[waves])
+            self.propogate(waves, positions[waves], log)
+            failed = failed | self.find_failed()
+            retry = waves[failed[waves] & (self.backtracks[waves] < self.max_backtracks)]
+            if len(retry) > 0:
+                self.backtrack(retry, positions[retry], log)
+                failed[retry] = self.find_failed()[retry]
+
+        done = self.collapsed.all(axis=1) & ~failed
+        for w in range(len(failed)):
+            if failed[w]:
+                self.finished.append(None)
+            elif done[w]:
+                self.finished.append(self.selected[w].copy())
+        self.reset(np.nonzero(failed | done)[0])
+
+    def next_attempt(self):
+        """Finds the result of the next Wave to finish, stepping the batch until one does.
+
+        Returns
+        -------
+        list <int>
+            The cores of the whole Wave, including its fixed ends, or None if the Wave failed
+        """
+
+        while not self.finished:
+            self.step()
+        cores = self.finished.popleft()
+        return None if cores is None else cores.tolist()
@@ -0,0 +1,188 @@
+import json
+import time
+
+class CollapseStats:
+    """Counters, phase timers and event hooks for the collapse of Waves.
+
+    A Wave or WaveElement only records into a CollapseStats it was given, so
+    collapses without one do no more than check that it is None.
+
+    Attributes
+    ----------
+    counters : dict {<str> : int}
+        The number of times each counted event happened
+    times : dict {<str> : float}
+        The seconds spent in each phase of the collapse
+    contradictions : dict {<int> : int}
+        The number of contradictions found at each index of the Wave
+    hooks : dict {<str> : list <function>}
+        The callbacks run for each event, called with the event and its details as keywords
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.times = {}
+        self.contradictions = {}
+        self.hooks = {}
+
+    def count(self, name, amount = 1):
+        """Adds to a counter.
+
+        Parameters
+        ----------
+        name : str
+            The counter to add to
+        amount : int, optional
+            How much to add
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def clock(self):
+        """Starts timing a phase.
+
+        Returns
+        -------
+        float
+            The current time, to be passed to lap
+        """
+
+        return time.perf_counter()
+
+    def lap(self, phase, start):
+        """Adds the time since start to a phase.
+
+        Parameters
+        ----------
+        phase : str
+            The phase being timed
+        start : float
+            The time the phase started, from clock or a previous lap
+
+        Returns
+        -------
+        float
+            The current time, so that the next phase can start from it
+        """
+
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - start
+        return now
+
+    def add_hook(self, event, callback):
+        """Calls a function every time an event happens.
+
+        The events are "decide", "contradiction", "backtrack", "attempt" and "produce".
+
+        Parameters
+        ----------
+        event : str
+            The event to watch
+        callback : function
+            Called with the event name and its details as keywords
+        """
+
+        self.hooks.setdefault(event, []).append(callback)
+
+    def remove_hook(self, event, callback):
+        """Stops calling a function added by add_hook.
+
+        Parameters
+        ----------
+        event : str
+        callback : function
+        """
+
+        if callback in self.hooks.get(event, []):
+            self.hooks[event].remove(callback)
+
+    def emit(self, event, **details):
+        """Counts an event and calls its hooks.
+
+        Parameters
+        ----------
+        event : str
+            The event that happened
+        **details
+            What the hooks are told about the event
+        """
+
+        self.counters[event] = self.counters.get(event, 0) + 1
+        for callback in self.hooks.get(event, ()):
+            callback(event, **details)
+
+    def contradiction(self, index):
+        """Records a WaveElement left without possible cores.
+
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement in its Wave
+        """
+
+        self.contradictions[index] = self.contradictions.get(index, 0) + 1
+        self.emit("contradiction", index=index)
+
+    def reset(self):
+        """Clears every counter and timer, keeping the hooks.
+        """
+
+        self.counters = {}
+        self.times = {}
+        self.contradictions = {}
+
+    def merge(self, other):
+        """Adds the counters and timers of another CollapseStats, or of its exported dict.
+
+        Parameters
+        ----------
+        other : CollapseStats or dict
+            The stats to add
+
+        Returns
+        -------
+        CollapseStats
+            These stats
+        """
+
+        if isinstance(other, CollapseStats):
+            other = other.to_dict()
+        for name, amount in other["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for phase, seconds in other["times"].items():
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+        for index, amount in other["contradictions"].items():
+            index = int(index)
+            self.contradictions[index] = self.contradictions.get(index, 0) + amount
+        return self
+
+    def to_dict(self):
+        """Exports the counters and timers.
+
+        Returns
+        -------
+        dict
+            The counters, times and contradictions by index
+        """
+
+        return {"counters" : dict(self.counters), "times" : dict(self.times),
+                "contradictions" : dict(sorted(self.contradictions.items()))}
+
+    def to_json(self, **options):
+        """Exports the counters and timers as JSON.
+
+        Parameters
+        ----------
+        **options
+            Arguments of json.dumps
+
+        Returns
+        -------
+        str
+            The JSON of to_dict
+        """
+
+        return json.dumps(self.to_dict(), **options)
+
+    def __repr__(self):
+        return "CollapseStats(" + self.to_json() + ")"
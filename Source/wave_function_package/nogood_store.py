@@ -0,0 +1,112 @@
+class NogoodStore:
+    """Bounded store of the small sets of decisions that led a Wave to a contradiction.
+
+    A nogood is a set of (index, core) decisions that left a WaveElement without possible cores
+    once propogated from the template. As a collapsed WaveElement no longer checks its own
+    sub-string, the same decisions made after others may not contradict, so a nogood only says
+    that with exactly its other decisions made, its last one fails. It is used by excluding
+    that core when a Wave decides on that index with exactly those decisions made. Nogoods are
+    only valid for the template they were learned from, so there is one store per template.
+
+    When the store is full, the nogoods that excluded the fewest cores are evicted.
+
+    Attributes
+    ----------
+    capacity : int
+        The largest number of nogoods kept
+    max_literals : int
+        The largest number of decisions in a nogood worth keeping
+    nogoods : dict {<frozenset> : int}
+        The number of times each nogood excluded a core, in the order they were learned
+    exclusions : dict {<frozenset> : dict {<int> : set <int>}}
+        For each set of decisions, the cores that fail at each index if decided next
+    """
+
+    def __init__(self, capacity = 1000, max_literals = 3):
+        """
+        Parameters
+        ----------
+        capacity : int, optional
+        max_literals : int, optional
+        """
+
+        self.capacity = capacity
+        self.max_literals = max_literals
+        self.nogoods = {}
+        self.exclusions = {}
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def learn(self, decisions):
+        """Records that a set of decisions led to a contradiction, if it is small enough.
+
+        Parameters
+        ----------
+        decisions : iterable <tuple>
+            The (index, core) of every decision
+
+        Returns
+        -------
+        bool
+            If a new nogood was recorded
+        """
+
+        nogood = frozenset(decisions)
+        if len(nogood) == 0 or len(nogood) > self.max_literals or nogood in self.nogoods:
+            return False
+        if len(self.nogoods) >= self.capacity:
+            self.evict()
+        self.nogoods[nogood] = 0
+        for index, core in nogood:
+            table = self.exclusions.setdefault(nogood - {(index, core)}, {})
+            table.setdefault(index, set()).add(core)
+        return True
+
+    def evict(self):
+        """Removes the quarter of the nogoods that excluded the fewest cores, the oldest first.
+        """
+
+        ranked = sorted(self.nogoods, key=self.nogoods.get)
+        for nogood in ranked[:max(1, len(ranked)//4)]:
+            del self.nogoods[nogood]
+            for index, core in nogood:
+                prefix = nogood - {(index, core)}
+                table = self.exclusions[prefix]
+                table[index].discard(core)
+                if not table[index]:
+                    del table[index]
+                if not table:
+                    del self.exclusions[prefix]
+
+    def excluded(self, decisions, index, possible_cores):
+        """Finds the cores known to fail at one index after exactly some decisions.
+
+        Parameters
+        ----------
+        decisions : list <tuple>
+            The (index, core) of every decision made
+        index : int
+            The index about to be decided
+        possible_cores : list <int>
+            The cores still possible at that index
+
+        Returns
+        -------
+        set <int>
+            The possible cores to exclude, empty if none
+        """
+
+        if len(decisions) >= self.max_literals:
+            return set()
+        prefix = frozenset(decisions)
+        table = self.exclusions.get(prefix)
+        if table is None or index not in table:
+            return set()
+        out = set()
+        for core in table[index]:
+            if core in possible_cores:
+                nogood = prefix | {(index, core)}
+                self.nogoods[nogood] = self.nogoods[nogood] + 1
+                out.add(core)
+        return out
@@ -0,0 +1,57 @@
+from wave_function_package import Patch
+
+class PackedPatches:
+    """Read-only list of Patches stored as packed integer arrays.
+
+    Each Patch is only built the first time it is used, so a model can be
+    loaded without building any Patch objects.
+
+    Attributes
+    ----------
+    cores : sequence <int>
+        The core of each Patch
+    raw_patches : sequence <int>
+        The complete sub-string of each Patch, one after the other
+    frequencies : sequence <int>
+        The frequency of each Patch
+    radius : int
+        The radius of every Patch
+    length : int
+        The length of every Patch
+    built : list <Patch>
+        The Patches built so far, None for the others
+    """
+
+    def __init__(self, cores, raw_patches, frequencies, radius):
+        """
+        Parameters
+        ----------
+        cores : sequence <int>
+        raw_patches : sequence <int>
+        frequencies : sequence <int>
+        radius : int
+        """
+
+        self.cores = cores
+        self.raw_patches = raw_patches
+        self.frequencies = frequencies
+        self.radius = radius
+        self.length = 2*radius + 1
+        self.built = [None]*len(cores)
+
+    def __len__(self):
+        return len(self.cores)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i = i + len(self.cores)
+        p = self.built[i]
+        if p is None:
+            raw_patch = tuple(self.raw_patches[i*self.length:(i+1)*self.length])
+            p = Patch(self.cores[i], raw_patch, self.radius, self.frequencies[i])
+            self.built[i] = p
+        return p
+
+    def __iter__(self):
+        for i in range(len(self.cores)):
+            yield self[i]
\ No newline at end of file
@@ -1,3 +1,5 @@
+import math
+
 class Patch:
     """Represents a single sub-string for purpose of wave-collapse.
     
@@ -5,7 +7,7 @@ class Patch:
     ----------
     core : int
         The central element of the sub-string
-    raw_patch : list <int>
+    raw_patch : tuple <int>
         The complete list of elements of the sub-string
     radius : int
         The radius of the sub-string, or the number of elements to one side of the core
@@ -13,16 +15,20 @@ class Patch:
         The length of the sub-string
     frequency : int
         The number of occurences of this sub-string within the base text
+    weight_log : float
+        frequency*log(frequency), kept for the running entropy sums of WaveElements
         """
     
+    __slots__ = ("core", "raw_patch", "radius", "length", "frequency", "weight_log")
+    
     def __init__(self, core, raw_patch, radius, frequency = 1):
         """
         Parameters
         ----------
         core : int
             The central element of the sub-string
-        raw_patch : list <int>
-            The complete list of elements of the sub-string
+        raw_patch : sequence <int>
+            The complete list of elements of the sub-string, stored as a tuple
         radius : int
             The radius of the sub-string, or the number of elements to one side of the core
         frequency : int, optional
@@ -30,10 +36,13 @@ class Patch:
         """
         
         self.core = core
-        self.raw_patch = raw_patch
+        self.raw_patch = tuple(raw_patch)
         self.radius = radius
         self.length = 2*radius + 1
-        self.frequency = frequency
+        self.set_frequency(frequency)
+        
+    def __reduce__(self):
+        return (Patch, (self.core, self.raw_patch, self.radius, self.frequency))
         
     def set_frequency(self, frequency):
         """
@@ -44,6 +53,7 @@ class Patch:
         """
         
         self.frequency = frequency
+        self.weight_log = frequency*math.log(frequency) if frequency > 0 else 0.0
         
     def add_frequency(self, increment):
         """
@@ -53,37 +63,4 @@ class Patch:
             The number of new occurences to add of this sub-string within the base text
         """
         
-        self.frequency = self.frequency + increment
-        
-    def same_pattern(self, other):
-        """
-        Parameters
-        ----------
-        other : Patch
-            Check if the patterns represented are the same between this Patch and another
-        """
-        
-        return self.core == other.core and self.raw_patch == other.raw_patch 
-    
-    def match_surroundings(self, surroundings):
-        """Check if this Patch could exist at the center of the possible wave surrounding it.
-        
-        Parameters
-        ----------
-        surroundings : list <WaveElement>
-            The possible wave surrounding this patch.
-        
-        Returns
-        -------
-        bool
-            If this Patch could exist at the center of the surroundings.
-            
-        """
-        
-        for i in range(self.radius):
-            #Invalid if any element of the patch is not possible in the corresponding location in the surroundings
-            if self.raw_patch[i] not in surroundings[i].possible_cores:
-                return False
-            if self.raw_patch[-1-i] not in surroundings[-1-i].possible_cores:
-                return False
-        return True
\ No newline at end of file
+        self.set_frequency(self.frequency + increment)
@@ -0,0 +1,207 @@
+class PatchAutomaton:
+    """Finite automaton over the Patches of a model, sampling valid strings without failing.
+
+    Each state is the 2*radius elements before a position, and each Patch is a
+    transition from its first 2*radius elements to its last 2*radius elements,
+    weighted by its frequency. A valid wave is a path starting in a state of
+    start cores and ending in a state of end cores, so counting the weighted
+    completions of every state backwards lets a single forward pass sample a
+    valid wave with probability proportional to the product of its Patch frequencies.
+
+    Attributes
+    ----------
+    radius : int
+        The radius of the Patches
+    word_start_core : int
+        The core value that represents the start of the wave
+    word_end_core : int
+        The core value that represents the end of the wave
+    state_ids : dict {<tuple> : int}
+        The identifier of each state
+    states : list <tuple>
+        The elements of each state
+    transitions : list <list <tuple>>
+        For each state, (core, frequency, next state) for every Patch leaving it
+    start_states : list <int>
+        The states whose first radius elements are start cores
+    accepting : list <bool>
+        If each state has end cores as its last radius elements
+    tables : dict {<tuple> : list <dict {<int> : float}>}
+        The completion weights of every state at every step, cached per size and constraints
+    """
+
+    def __init__(self, patches_list, radius, word_start_core, word_end_core):
+        """
+        Parameters
+        ----------
+        patches_list : list <Patch>
+        radius : int
+        word_start_core : int
+        word_end_core : int
+        """
+
+        self.radius = radius
+        self.word_start_core = word_start_core
+        self.word_end_core = word_end_core
+        self.state_ids = {}
+        self.states = []
+        self.transitions = []
+        for p in patches_list:
+            raw = p.raw_patch
+            source = self.get_state(raw[:2*radius])
+            target = self.get_state(raw[1:])
+            self.transitions[source].append((p.core, p.frequency, target))
+        self.start_states = [i for i in range(len(self.states))
+                             if all(c == word_start_core for c in self.states[i][:radius])]
+        self.accepting = [all(c == word_end_core for c in state[radius:]) for state in self.states]
+        self.tables = {}
+
+    def get_state(self, elements):
+        """Finds the identifier of a state, adding the state if it is new.
+
+        Parameters
+        ----------
+        elements : tuple <int>
+            The 2*radius elements of the state
+
+        Returns
+        -------
+        int
+            The identifier of the state
+        """
+
+        if elements not in self.state_ids:
+            self.state_ids[elements] = len(self.states)
+            self.states.append(elements)
+            self.transitions.append([])
+        return self.state_ids[elements]
+
+    def allowed_core(self, core, allowed, exact_length):
+        """Checks a core against the constraints of one position.
+
+        Parameters
+        ----------
+        core : int
+            The core of a transition
+        allowed : set <int>
+            The cores allowed at the position, or None for any
+        exact_length : bool
+            If start and end cores are banned at the position
+
+        Returns
+        -------
+        bool
+            If the core may be used
+        """
+
+        if allowed is not None and core not in allowed:
+            return False
+        return not (exact_length and (core == self.word_start_core or core == self.word_end_core))
+
+    def count_completions(self, size, constraints = None, exact_length = False):
+        """Counts the weighted completions of every state at every step, backwards from the end.
+
+        Each step is scaled so its largest weight is 1, since sampling only compares weights of the same step.
+
+        Parameters
+        ----------
+        size : int
+            The number of positions between the fixed ends
+        constraints : dict {<int> : set <int>}, optional
+            The cores allowed at some positions
+        exact_length : bool, optional
+            If start and end cores are banned between the fixed ends
+
+        Returns
+        -------
+        list <dict {<int> : float}>
+            For each step, the scaled weight of every state with a completion
+        """
+
+        if constraints is None:
+            constraints = {}
+        key = (size, tuple(sorted((i, frozenset(c)) for i, c in constraints.items())), exact_length)
+        if key in self.tables:
+            return self.tables[key]
+
+        layers = [None]*(size + 1)
+        layers[size] = {s : 1.0 for s in range(len(self.states)) if self.accepting[s]}
+        for t in range(size - 1, -1, -1):
+            following = layers[t + 1]
+            allowed = constraints.get(t)
+            layer = {}
+            for s in range(len(self.states)):
+                total = 0.0
+                for core, frequency, target in self.transitions[s]:
+                    if target in following and self.allowed_core(core, allowed, exact_length):
+                        total = total + frequency*following[target]
+                if total > 0:
+                    layer[s] = total
+            if layer:
+                scale = max(layer.values())
+                layer = {s : w/scale for s, w in layer.items()}
+            layers[t] = layer
+        self.tables[key] = layers
+        return layers
+
+    def is_feasible(self, size, constraints = None, exact_length = False):
+        """Checks if any valid wave exists.
+
+        Parameters
+        ----------
+        size : int
+            The number of positions between the fixed ends
+        constraints : dict {<int> : set <int>}, optional
+            The cores allowed at some positions
+        exact_length : bool, optional
+            If start and end cores are banned between the fixed ends
+
+        Returns
+        -------
+        bool
+            If at least one valid wave exists
+        """
+
+        first = self.count_completions(size, constraints, exact_length)[0]
+        return any(s in first for s in self.start_states)
+
+    def sample(self, rng, size, constraints = None, exact_length = False):
+        """Samples a valid wave in a single forward pass.
+
+        Parameters
+        ----------
+        rng : random.Random
+            The source of randomness
+        size : int
+            The number of positions between the fixed ends
+        constraints : dict {<int> : set <int>}, optional
+            The cores allowed at some positions
+        exact_length : bool, optional
+            If start and end cores are banned between the fixed ends
+
+        Returns
+        -------
+        list <int>
+            The cores of the whole wave, including its fixed ends, or None if no valid wave exists
+        """
+
+        if constraints is None:
+            constraints = {}
+        layers = self.count_completions(size, constraints, exact_length)
+        starts = [s for s in self.start_states if s in layers[0]]
+        if len(starts) == 0:
+            return None
+        state = rng.choices(starts, [layers[0][s] for s in starts])[0]
+        cores = list(self.states[state])
+        for t in range(size):
+            following = layers[t + 1]
+            allowed = constraints.get(t)
+            options = []
+            weights = []
+            for core, frequency, target in self.transitions[state]:
+                if target in following and self.allowed_core(core, allowed, exact_length):
+                    options.append((target, core))
+                    weights.append(frequency*following[target])
+            state, core = rng.choices(options, weights)[0]
+            cores.append(self.states[state][-1] if self.radius > 0 else core)
+        return cores
\ No newline at end of file
@@ -0,0 +1,403 @@
+import math
+import sys
+from wave_function_package import Patch
+
+class PatchIndex:
+    """Precomputed compatibility index over every Patch of a model.
+
+    The index is built once per model and shared by every Wave made from it,
+    so that culling a WaveElement against one neighbor only has to look at the
+    slot of the sub-string that the neighbor covers.
+
+    Every Patch is identified by its position in the index, and sets of Patches
+    are Python ints used as bitsets, where bit i is set if Patch i is in the set.
+    Culling a WaveElement is then a few AND operations on its bitset.
+
+    Attributes
+    ----------
+    patches_list : list <Patch> or PackedPatches
+        Every possible Patch, in the order of their identifiers
+    radius : int
+        The radius of the Patches
+    length : int
+        The length of the Patches
+    cores : list <int>
+        Every core value used by a Patch
+    allowed : dict {<int> : list <set <int>>}
+        For each core, the set of cores its Patches allow at each slot of the sub-string
+    ids : dict {<tuple> : int}
+        The identifier of the Patch of each sub-string
+    patch_cores : list <int>
+        The core of each Patch
+    frequencies : list <int>
+        The frequency of each Patch
+    weight_logs : list <float>
+        The frequency*log(frequency) of each Patch
+    core_masks : dict {<int> : int}
+        The bitset of the Patches of each core
+    slot_masks : list <dict {<int> : int}>
+        For each slot of the sub-string, the bitset of the Patches with each core at that slot
+    all_mask : int
+        The bitset of every Patch
+    core_weights : dict {<int> : int}
+        The total frequency of the Patches of each core
+    core_weight_logs : dict {<int> : float}
+        The total frequency*log(frequency) of the Patches of each core
+    free_ids : list <int>
+        The identifiers of removed Patches, given to the next Patches added
+    """
+
+    def __init__(self, patches_list, radius):
+        """
+        Parameters
+        ----------
+        patches_list : list <Patch>
+        radius : int
+        """
+
+        self.patches_list = []
+        self.radius = radius
+        self.length = 2*radius + 1
+        self.cores = []
+        self.allowed = {}
+        self.ids = {}
+        self.patch_cores = []
+        self.frequencies = []
+        self.weight_logs = []
+        self.core_masks = {}
+        self.slot_masks = [{} for i in range(self.length)]
+        self.all_mask = 0
+        self.core_weights = {}
+        self.core_weight_logs = {}
+        self.free_ids = []
+        self.add_patches(patches_list)
+
+    @classmethod
+    def from_packed(cls, packed):
+        """Builds the index of a PackedPatches straight from its arrays.
+
+        No Patch is built, and patches_list is the PackedPatches itself, which builds each Patch
+        the first time it is used.
+
+        Parameters
+        ----------
+        packed : PackedPatches
+
+        Returns
+        -------
+        PatchIndex
+        """
+
+        index = cls([], packed.radius)
+        index.patches_list = packed
+        raws = zip(*[iter(packed.raw_patches)]*packed.length)
+        index.index_entries((core, raw, frequency, frequency*math.log(frequency) if frequency > 0 else 0.0)
+                            for core, raw, frequency in zip(packed.cores, raws, packed.frequencies))
+        return index
+
+    def add_patch(self, patch):
+        """Adds one Patch to the index, giving it the next identifier.
+
+        Parameters
+        ----------
+        patch : Patch
+            A single Patch
+
+        Returns
+        -------
+        int
+            The identifier of the Patch
+        """
+
+        return self.add_patches([patch])[0]
+
+    def add_patches(self, patches):
+        """Adds Patches to the index, giving them the identifiers of removed Patches first, then the next ones in order.
+
+        Parameters
+        ----------
+        patches : iterable <Patch>
+
+        Returns
+        -------
+        list <int>
+            The identifier of each Patch
+        """
+
+        patches = list(patches)
+        ids = self.index_entries((p.core, p.raw_patch, p.frequency, p.weight_log) for p in patches)
+        for i, patch in zip(ids, patches):
+            if i < len(self.patches_list):
+                self.patches_list[i] = patch
+            else:
+                self.patches_list.append(patch)
+        return ids
+
+    def index_entries(self, entries):
+        """Adds the Patches described by entries to every table and bitset, reusing the identifiers of free_ids first.
+
+        The Patches themselves are not put in patches_list. The ids of each bitset are gathered 
+        first and every bitset is built once, as building them one bit at a time takes quadratic time 
+        on large models.
+
+        Parameters
+        ----------
+        entries : iterable <tuple>
+            The (core, raw_patch, frequency, weight_log) of each Patch
+
+        Returns
+        -------
+        list <int>
+            The identifier given to each Patch
+        """
+
+        new_ids = []
+        core_ids = {}
+        slot_ids = [{} for i in range(self.length)]
+        for core, raw, frequency, weight_log in entries:
+            if self.free_ids:
+                i = self.free_ids.pop()
+                self.patch_cores[i] = core
+                self.frequencies[i] = frequency
+                self.weight_logs[i] = weight_log
+            else:
+                i = len(self.patch_cores)
+                self.patch_cores.append(core)
+                self.frequencies.append(frequency)
+                self.weight_logs.append(weight_log)
+            new_ids.append(i)
+            self.ids[raw] = i
+            if core not in self.allowed:
+                self.cores.append(core)
+                self.allowed[core] = [set() for s in range(self.length)]
+                self.core_masks[core] = 0
+                self.core_weights[core] = 0
+                self.core_weight_logs[core] = 0.0
+            slots = self.allowed[core]
+            for s in range(self.length):
+                slots[s].add(raw[s])
+                ids = slot_ids[s].get(raw[s])
+                if ids is None:
+                    slot_ids[s][raw[s]] = [i]
+                else:
+                    ids.append(i)
+            ids = core_ids.get(core)
+            if ids is None:
+                core_ids[core] = [i]
+            else:
+                ids.append(i)
+            self.core_weights[core] = self.core_weights[core] + frequency
+            self.core_weight_logs[core] = self.core_weight_logs[core] + weight_log
+        for core, ids in core_ids.items():
+            self.core_masks[core] = self.core_masks[core] | _mask(ids)
+        for s in range(self.length):
+            masks = self.slot_masks[s]
+            for core, ids in slot_ids[s].items():
+                masks[core] = masks.get(core, 0) | _mask(ids)
+        if new_ids:
+            self.all_mask = self.all_mask | _mask(new_ids)
+        return new_ids
+
+    def add_frequency(self, i, increment):
+        """Changes the frequency of one Patch in place, with Patch.add_frequency.
+
+        Parameters
+        ----------
+        i : int
+            The identifier of the Patch
+        increment : int
+            The change of frequency, which must leave it above 0
+
+        Returns
+        -------
+        float
+            The change of frequency*log(frequency) of the Patch
+        """
+
+        patch = self.patches_list[i]
+        weight_log = patch.weight_log
+        patch.add_frequency(increment)
+        self.frequencies[i] = patch.frequency
+        self.weight_logs[i] = patch.weight_log
+        self.core_weights[patch.core] = self.core_weights[patch.core] + increment
+        self.core_weight_logs[patch.core] = self.core_weight_logs[patch.core] + patch.weight_log - weight_log
+        return patch.weight_log - weight_log
+
+    def remove_patches(self, ids):
+        """Removes Patches from every bitset of the index.
+
+        The Patches keep a frequency of 0 until their identifiers are given to new Patches by
+        add_patches. A core left without Patches is removed from cores.
+
+        Parameters
+        ----------
+        ids : list <int>
+            The identifiers of the Patches to remove
+        """
+
+        if len(ids) == 0:
+            return
+        removed = _mask(ids)
+        cores = set()
+        for i in ids:
+            patch = self.patches_list[i]
+            if self.ids.get(patch.raw_patch) == i:
+                del self.ids[patch.raw_patch]
+            self.core_weights[patch.core] = self.core_weights[patch.core] - self.frequencies[i]
+            self.core_weight_logs[patch.core] = self.core_weight_logs[patch.core] - self.weight_logs[i]
+            self.frequencies[i] = 0
+            self.weight_logs[i] = 0.0
+            cores.add(patch.core)
+            for s in range(self.length):
+                masks = self.slot_masks[s]
+                core = patch.raw_patch[s]
+                if core in masks:
+                    masks[core] = masks[core] & ~removed
+                    if masks[core] == 0:
+                        del masks[core]
+        self.all_mask = self.all_mask & ~removed
+        self.free_ids.extend(ids)
+        for core in cores:
+            self.core_masks[core] = self.core_masks[core] & ~removed
+            if self.core_masks[core] == 0:
+                self.cores.remove(core)
+                del self.allowed[core]
+                del self.core_masks[core]
+                del self.core_weights[core]
+                del self.core_weight_logs[core]
+                continue
+            slots = [set() for s in range(self.length)]
+            for i in self.iter_ids(self.core_masks[core]):
+                for s, c in enumerate(self.patches_list[i].raw_patch):
+                    slots[s].add(c)
+            self.allowed[core] = slots
+
+    def copy(self):
+        """Copies the index with copies of its Patches, so that either can be changed without the other.
+
+        Returns
+        -------
+        PatchIndex
+            The copy
+        """
+
+        other = PatchIndex([], self.radius)
+        other.patches_list = [Patch(p.core, p.raw_patch, p.radius, p.frequency) for p in self.patches_list]
+        other.cores = list(self.cores)
+        other.allowed = {core : [set(slot) for slot in slots] for core, slots in self.allowed.items()}
+        other.ids = dict(self.ids)
+        other.patch_cores = list(self.patch_cores)
+        other.frequencies = list(self.frequencies)
+        other.weight_logs = list(self.weight_logs)
+        other.core_masks = dict(self.core_masks)
+        other.slot_masks = [dict(masks) for masks in self.slot_masks]
+        other.all_mask = self.all_mask
+        other.core_weights = dict(self.core_weights)
+        other.core_weight_logs = dict(self.core_weight_logs)
+        other.free_ids = list(self.free_ids)
+        return other
+
+    def memory(self):
+        """Estimates the bytes used by the index and its Patches.
+
+        Returns
+        -------
+        int
+        """
+
+        size = sum(sys.getsizeof(x) for x in (self.patches_list, self.ids, self.patch_cores, self.frequencies,
+                                              self.weight_logs, self.core_masks, self.all_mask))
+        size = size + sum(sys.getsizeof(patch) + sys.getsizeof(patch.raw_patch) for patch in self.patches_list)
+        size = size + sum(sys.getsizeof(mask) for mask in self.core_masks.values())
+        for masks in self.slot_masks:
+            size = size + sys.getsizeof(masks) + sum(sys.getsizeof(mask) for mask in masks.values())
+        return size
+
+    def allowed_at(self, core, slot):
+        """Finds the cores that Patches of a core allow at one slot of the sub-string.
+
+        Parameters
+        ----------
+        core : int
+            The central element of the Patches
+        slot : int
+            The position within the sub-string, from 0 to length-1
+
+        Returns
+        -------
+        set <int>
+            The cores allowed at that slot
+        """
+
+        return self.allowed[core][slot]
+
+    def removed_at(self, slot, allowed_cores):
+        """Finds the Patches that need a core outside of allowed_cores at one slot of their sub-string.
+
+        Parameters
+        ----------
+        slot : int
+            The position within the sub-string, from 0 to length-1
+        allowed_cores : set <int>
+            The cores still possible at that slot
+
+        Returns
+        -------
+        int
+            The bitset of the Patches to remove
+        """
+
+        masks = self.slot_masks[slot]
+        if 2*len(allowed_cores) < len(masks):
+            kept = 0
+            for c in allowed_cores:
+                kept = kept | masks.get(c, 0)
+            return self.all_mask & ~kept
+        removed = 0
+        for c, mask in masks.items():
+            if c not in allowed_cores:
+                removed = removed | mask
+        return removed
+
+    def iter_ids(self, mask):
+        """Lists the identifiers of the Patches in a bitset.
+
+        Parameters
+        ----------
+        mask : int
+            A bitset of Patches
+
+        Returns
+        -------
+        list <int>
+            The identifiers, in increasing order
+        """
+
+        if mask == 0:
+            return []
+        low = (mask & -mask).bit_length() - 1
+        bits = bin(mask >> low)[:1:-1]
+        out = []
+        i = bits.find("1")
+        while i >= 0:
+            out.append(low + i)
+            i = bits.find("1", i + 1)
+        return out
+
+def _mask(ids):
+    """Builds the bitset of identifiers through a bytearray.
+
+    Parameters
+    ----------
+    ids : list <int>
+
+    Returns
+    -------
+    int
+        The bitset
+    """
+
+    bits = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        bits[i >> 3] = bits[i >> 3] | (1 << (i & 7))
+    return int.from_bytes(bits, "little")
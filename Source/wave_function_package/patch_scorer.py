@@ -0,0 +1,155 @@
+import math
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class PatchScorer:
+    """Scores sequences of cores against the Patches of a model, without collapsing any Wave.
+
+    A sequence is valid if every sub-string of it is a Patch. Its log-likelihood is that of the
+    (2*radius+1)-gram model of the Patches, where each sub-string follows its first 2*radius
+    elements with the frequency of its Patch over the total frequency of the Patches starting
+    with the same elements.
+
+    With NumPy, every sub-string is encoded as an integer and looked up in a sorted array,
+    for a whole batch of sequences at once. Without it, or when the codes would
+    not fit in 64 bits, each sub-string is looked up in a dict.
+
+    Attributes
+    ----------
+    radius : int
+        The radius of the Patches
+    length : int
+        The length of the Patches
+    base : int
+        The base of the codes, two more than the largest core of a Patch, so that the unknown elements
+        encoded as base-1 match nothing
+    log_probs : dict {<tuple> : float}
+        The log-probability of each Patch, by sub-string
+    keys : numpy.ndarray
+        The sorted codes of the Patches, or None without NumPy
+    values : numpy.ndarray
+        The log-probability of the Patch of each code in keys
+    """
+
+    def __init__(self, patch_index):
+        """
+        Parameters
+        ----------
+        patch_index : PatchIndex
+            The index of the Patches to score against
+        """
+
+        self.radius = patch_index.radius
+        self.length = patch_index.length
+        live = patch_index.iter_ids(patch_index.all_mask)
+        raws = [patch_index.patches_list[i].raw_patch for i in live]
+        frequencies = [patch_index.frequencies[i] for i in live]
+        contexts = {}
+        for raw, frequency in zip(raws, frequencies):
+            contexts[raw[:-1]] = contexts.get(raw[:-1], 0) + frequency
+        self.log_probs = {raw : math.log(frequency/contexts[raw[:-1]]) for raw, frequency in zip(raws, frequencies)}
+        self.base = max((c for raw in raws for c in raw), default=0) + 2
+        self.keys = None
+        self.values = None
+        if np is not None and self.base**self.length < 1 << 63:
+            codes = [self.encode(raw) for raw in raws]
+            order = sorted(range(len(codes)), key=codes.__getitem__)
+            self.keys = np.array([codes[i] for i in order], dtype=np.int64)
+            self.values = np.array([self.log_probs[raws[i]] for i in order], dtype=np.float64)
+
+    def encode(self, raw):
+        """Encodes one sub-string as an integer.
+
+        Parameters
+        ----------
+        raw : tuple <int>
+
+        Returns
+        -------
+        int
+            The code
+        """
+
+        code = 0
+        for c in raw:
+            code = code*self.base + c
+        return code
+
+    def score(self, sequences):
+        """Scores padded sequences of cores.
+
+        Parameters
+        ----------
+        sequences : list <list <int>>
+            The cores of each sequence, with its padding, and -1 for elements the model does not have
+
+        Returns
+        -------
+        tuple (list <bool>, list <float>)
+            If every sub-string of each sequence is a Patch, and the log-likelihood of each sequence,
+            -inf if it is not valid
+        """
+
+        if self.keys is None:
+            return self.score_patches(sequences)
+        if len(sequences) == 0:
+            return [], []
+        length = self.length
+        sizes = np.array([len(s) for s in sequences], dtype=np.int64)
+        if sizes.min() < length:
+            raise Exception("Every sequence must be padded to at least the length of a Patch")
+        flat = np.fromiter(chain.from_iterable(sequences), dtype=np.int64, count=int(sizes.sum()))
+        flat[(flat < 0) | (flat >= self.base)] = self.base - 1
+        counts = sizes - length + 1
+        firsts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        starts = np.repeat(offsets - firsts, counts) + np.arange(int(counts.sum()), dtype=np.int64)
+        codes = flat[starts]
+        for s in range(1, length):
+            codes = codes*self.base + flat[starts + s]
+        if len(self.keys) == 0:
+            return [False]*len(sequences), [-math.inf]*len(sequences)
+        positions = np.minimum(np.searchsorted(self.keys, codes), len(self.keys) - 1)
+        found = self.keys[positions] == codes
+        log_probs = np.where(found, self.values[positions], 0.0)
+        valid = np.add.reduceat(found.astype(np.int64), firsts) == counts
+        totals = np.where(valid, np.add.reduceat(log_probs, firsts), -np.inf)
+        return valid.tolist(), totals.tolist()
+
+    def score_patches(self, sequences):
+        """Scores padded sequences of cores one sub-string at a time, without NumPy.
+
+        Parameters
+        ----------
+        sequences : list <list <int>>
+            The cores of each sequence, with its padding, and -1 for elements the model does not have
+
+        Returns
+        -------
+        tuple (list <bool>, list <float>)
+            If every sub-string of each sequence is a Patch, and the log-likelihood of each sequence,
+            -inf if it is not valid
+        """
+
+        log_probs = self.log_probs
+        length = self.length
+        valid = []
+        totals = []
+        for sequence in sequences:
+            if len(sequence) < length:
+                raise Exception("Every sequence must be padded to at least the length of a Patch")
+            sequence = tuple(sequence)
+            total = 0.0
+            for i in range(len(sequence) - length + 1):
+                log_prob = log_probs.get(sequence[i:i+length])
+                if log_prob is None:
+                    total = -math.inf
+                    break
+                total = total + log_prob
+            valid.append(total != -math.inf)
+            totals.append(total)
+        return valid, totals
@@ -0,0 +1,96 @@
+class Trail:
+    """Undo log of WaveElement states, grouped by the collapse decisions of a Wave.
+
+    Each WaveElement is saved at most once per decision, just before its first
+    change, so undoing a decision restores every element it touched.
+
+    Attributes
+    ----------
+    entries : list <tuple>
+        (index, state, stamp) for every saved WaveElement, oldest first
+    decisions : list <list>
+        [mark, index, core, epoch] for every open decision, oldest first
+    stamps : list <int>
+        The epoch in which each WaveElement was last saved
+    epoch : int
+        The identifier of the current decision, 0 before any decision
+    next_epoch : int
+        The identifier the next decision will use
+    """
+
+    def __init__(self, size):
+        """
+        Parameters
+        ----------
+        size : int
+            The number of WaveElements in the Wave
+        """
+
+        self.entries = []
+        self.decisions = []
+        self.stamps = [0]*size
+        self.epoch = 0
+        self.next_epoch = 1
+
+    def save(self, index, element):
+        """Saves the state of a WaveElement if it was not already saved for the current decision.
+
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement
+        element : WaveElement
+            The WaveElement about to change
+        """
+
+        if self.stamps[index] != self.epoch:
+            self.entries.append((index, element.get_state(), self.stamps[index]))
+            self.stamps[index] = self.epoch
+
+    def push(self, index):
+        """Opens a new decision to collapse the WaveElement at index.
+
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement being collapsed
+        """
+
+        self.decisions.append([len(self.entries), index, -1, self.epoch])
+        self.epoch = self.next_epoch
+        self.next_epoch = self.next_epoch + 1
+
+    def set_choice(self, core):
+        """Records the core chosen by the current decision.
+
+        Parameters
+        ----------
+        core : int
+            The core the WaveElement collapsed to
+        """
+
+        self.decisions[-1][2] = core
+
+    def undo(self, waveform):
+        """Closes the current decision and restores every WaveElement it changed.
+
+        Parameters
+        ----------
+        waveform : list <WaveElement>
+            The WaveElements of the Wave
+
+        Returns
+        -------
+        tuple (int, int, set <int>)
+            The index and core of the undone decision, and the indices of every restored WaveElement
+        """
+
+        mark, index, core, epoch = self.decisions.pop()
+        restored = set()
+        while len(self.entries) > mark:
+            i, state, stamp = self.entries.pop()
+            waveform[i].set_state(state)
+            self.stamps[i] = stamp
+            restored.add(i)
+        self.epoch = epoch
+        return index, core, restored
\ No newline at end of file
@@ -1,7 +1,12 @@
 import random
 import math
+import heapq
+from collections import deque
 from wave_function_package import Patch
+from wave_function_package import PatchIndex
 from wave_function_package import WaveElement
+from wave_function_package import Trail
+from wave_function_package import NogoodStore
 
 class Wave:
     """Represents a complete wave function in super-position.
@@ -12,6 +17,8 @@ class Wave:
         The current state of the wave function
     patches_list : list <Patch>
         Every possible Patch
+    patch_index : PatchIndex
+        The compatibility index of every possible Patch
     radius : int
         The radius of interaction and Patches 
     max_size : int
@@ -24,9 +31,39 @@ class Wave:
         If the wave collapsed into a valid state
     worst_quality : int
         The highest value for quality of an element in the wave
+    heuristic : str
+        How the quality of an element is measured, "entropy" or "normalization"
+    heap : list <tuple>
+        Priority queue of (quality, tie-break, index, version) for uncollapsed elements
+    versions : list <int>
+        The current version of each element, older heap entries are ignored
+    max_backtracks : int
+        How many failed decisions may be undone before the collapse gives up, 0 to never backtrack
+    backtracks : int
+        How many failed decisions have been undone
+    trail : Trail
+        The undo log of the collapse, None when not backtracking
+    template : list <WaveElement>
+        The initial super-position with the start and end propogated, cloned by populate
+    rng : random.Random
+        The source of randomness for every choice made by the collapse
+    exact_length : bool
+        If the start and end cores are banned between the fixed ends, so the text fills the whole wave
+    constraints : dict {<int> : set <int>}
+        The cores allowed at some positions between the fixed ends, 0 being the first position after the start
+    stats : CollapseStats
+        Where the collapse is counted and timed, None to not instrument it
+    nogoods : NogoodStore
+        The contradictions learned by every Wave of the same template, None to not learn them
+    decisions : list <tuple>
+        The (index, core) of every open decision, oldest first
+    pins : dict {<int> : int}
+        The core fixed by pin at some positions, 0 being the first position after the start
     """
     
-    def __init__(self, radius, max_size, word_start_core, word_end_core, patches_list):
+    def __init__(self, radius, max_size, word_start_core, word_end_core, patches_list, patch_index = None, heuristic = "entropy",
+                 max_backtracks = 0, template = None, rng = None, exact_length = False, constraints = None, stats = None,
+                 nogoods = None):
         """
         Parameters
         ----------
@@ -35,27 +72,122 @@ class Wave:
         word_start_core : int
         word_end_core : int
         patches_list : list <Patch>
+        patch_index : PatchIndex, optional
+            A prebuilt index of patches_list, built here if not given
+        heuristic : str, optional
+            How the quality of an element is measured, "entropy" or "normalization"
+        max_backtracks : int, optional
+            How many failed decisions may be undone before the collapse gives up
+        template : list <WaveElement>, optional
+            The template of another Wave with the same parameters, compiled here if not given
+        rng : random.Random, optional
+            The source of randomness, the global random module if not given
+        exact_length : bool, optional
+            If the text must fill the whole wave, without more start or end cores
+        constraints : dict {<int> : set <int>}, optional
+            The cores allowed at some positions between the fixed ends, 0 being the first position after the start
+        stats : CollapseStats, optional
+            Where to count and time the collapse, not instrumented if not given
+        nogoods : NogoodStore, optional
+            The contradictions learned from the same template, shared with later Waves
         """
         
         self.waveform = []
         self.patches_list = patches_list
+        if patch_index is None:
+            patch_index = PatchIndex(patches_list, radius)
+        self.patch_index = patch_index
         self.radius = radius
         self.max_size = max_size
         self.word_start_core = word_start_core
         self.word_end_core = word_end_core
+        self.heuristic = heuristic
+        self.heap = []
+        self.versions = []
+        self.max_backtracks = max_backtracks
+        self.backtracks = 0
+        self.trail = None
+        self.template = template
+        self.rng = rng if rng is not None else random
+        self.exact_length = exact_length
+        self.constraints = constraints if constraints is not None else {}
+        self.stats = stats
+        self.nogoods = nogoods
+        self.decisions = []
+        self.pins = {}
         self.populate()
         self.success = True
         self.worst_quality = 0
         
-    def populate(self):
-        """Generates the complete super-position of the wave and populates it with WaveElements
+    def compile_template(self):
+        """Builds the initial super-position once, with the start and end cores fixed and propogated.
+        
+        The constraints are applied and propogated through the whole wave as well, so a template 
+        with an element left without possible cores can never collapse.
         """
         
-        self.waveform = [ WaveElement(self.patches_list) for i in range(2*self.radius + self.max_size)]
-        self.worst_quality = self.waveform[0].get_collapse_quality()
+        self.trail = None
+        self.waveform = [ WaveElement(self.patches_list, self.patch_index) for i in range(2*self.radius + self.max_size)]
+        self.worst_quality = self.waveform[0].get_collapse_quality(self.heuristic)
+        self.heap = []
+        self.versions = [0]*len(self.waveform)
+        fixed = []
         for i in range(self.radius):
             self.waveform[i].fixed_collapse(self.word_start_core)
             self.waveform[-1-i].fixed_collapse(self.word_end_core)
+            fixed.append(i)
+            fixed.append(len(self.waveform)-1-i)
+        if self.exact_length:
+            for i in range(self.radius, self.radius + self.max_size):
+                self.waveform[i].ban_core(self.word_start_core)
+                self.waveform[i].ban_core(self.word_end_core)
+                fixed.append(i)
+        for position in self.constraints:
+            i = self.radius + position
+            for core in list(self.waveform[i].possible_cores):
+                if core not in self.constraints[position]:
+                    self.waveform[i].ban_core(core)
+            fixed.append(i)
+        self.propogate(fixed)
+        self.template = self.waveform
+        
+    def populate(self):
+        """Populates the wave with a clone of the complete super-position, compiling it first if needed.
+        """
+        
+        if self.stats is not None:
+            start = self.stats.clock()
+        if self.template is None or len(self.template) != 2*self.radius + self.max_size:
+            self.compile_template()
+            if self.stats is not None:
+                start = self.stats.lap("compile", start)
+        self.waveform = [ we.clone() for we in self.template ]
+        self.versions = [0]*len(self.waveform)
+        self.decisions = []
+        self.heap = [ (self.waveform[i].get_collapse_quality(self.heuristic), self.rng.random(), i, 0)
+                      for i in range(len(self.waveform)) if not self.waveform[i].collapsed ]
+        heapq.heapify(self.heap)
+        self.backtracks = 0
+        self.trail = Trail(len(self.waveform)) if self.max_backtracks > 0 else None
+        if self.stats is not None:
+            self.stats.lap("populate", start)
+            
+    def learn(self, index):
+        """Records the open decisions as a nogood after the decision at index led to a contradiction.
+        
+        Nothing is learned once the Wave has backtracked, as its state then also depends on 
+        the cores banned by backtracking.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement propogated from
+        """
+        
+        if self.nogoods is None or self.backtracks > 0 or len(self.decisions) == 0 or self.decisions[-1][0] != index:
+            return
+        if self.nogoods.learn(self.decisions) and self.stats is not None:
+            self.stats.count("nogoods_learned")
             
     def seed_collapse(self):
         """Chooses a random index of the wave and collapses it to begin the wave function collapse.
@@ -66,87 +198,255 @@ class Wave:
             The index of the element collapsed
         """
         
-        index = random.randint(0,self.max_size-1)
-        self.waveform[self.radius + index].probable_collapse()
+        index = self.radius + self.rng.randint(0,self.max_size-1)
+        self.decide(index)
         return index
     
+    def update_priority(self, index):
+        """Queues a WaveElement with its current quality, invalidating its older entries.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement that changed
+        """
+        
+        self.versions[index] = self.versions[index] + 1
+        quality = self.waveform[index].get_collapse_quality(self.heuristic)
+        heapq.heappush(self.heap, (quality, self.rng.random(), index, self.versions[index]))
+        
+    def select_best(self):
+        """Find the uncollapsed WaveElement of lowest quality, breaking ties randomly.
+        
+        Returns
+        -------
+        int
+            The index of the element, or -1 if every element is collapsed
+        """
+        
+        while self.heap:
+            quality, tie, index, version = heapq.heappop(self.heap)
+            if version == self.versions[index] and not self.waveform[index].collapsed:
+                return index
+        return -1
+    
     def do_best_collapse(self):
         """Find and collapse the best possible WaveElement
 
         Returns
         -------
         int
-            The index of the element collapsed
+            The index of the element collapsed, or -1 if every element is collapsed
         """
         
-        best_quality = self.worst_quality *2 + 1000
-        i_list = []
-        for i in range(len(self.waveform)):
-            if not self.waveform[i].collapsed:
-                if self.waveform[i].get_collapse_quality() < best_quality:
-                    best_quality = self.waveform[i].get_collapse_quality()
-                    i_list = [i]
-                elif self.waveform[i].get_collapse_quality() == best_quality:
-                    i_list.append(i)
-        i = random.choice(i_list)
-        self.waveform[i].probable_collapse()
+        i = self.select_best()
+        if i >= 0:
+            self.decide(i)
         return i
     
-    def cull_at(self,index):
-        """Removes invalid Patches from the selected WaveElement, bringing it closer to collapse.
+    def save(self, index):
+        """Saves a WaveElement to the trail before it changes, if backtracking.
         
         Parameters
         ----------
         index : int
-            The index of the WaveElement to cull
+            The index of the WaveElement about to change
+        """
+        
+        if self.trail is not None:
+            self.trail.save(index, self.waveform[index])
+    
+    def decide(self, index):
+        """Collapses a WaveElement via probability, recording the choice as a decision on the trail.
+        
+        Cores that learned nogoods show to fail after exactly the current decisions are excluded, 
+        and if every core is excluded they are banned instead, leaving the WaveElement without cores.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement to collapse
+        """
+        
+        we = self.waveform[index]
+        excluded = ()
+        if self.nogoods is not None and len(self.nogoods) > 0:
+            excluded = self.nogoods.excluded(self.decisions, index, we.possible_cores)
+            if self.stats is not None and excluded:
+                self.stats.count("nogood_exclusions", len(excluded))
+            if len(excluded) == len(we.possible_cores):
+                self.save(index)
+                for core in excluded:
+                    we.ban_core(core)
+                return
+        if self.trail is not None:
+            self.trail.push(index)
+            self.save(index)
+        we.probable_collapse(self.rng, excluded)
+        self.decisions.append((index, self.waveform[index].selected_core))
+        if self.trail is not None:
+            self.trail.set_choice(self.waveform[index].selected_core)
+        if self.stats is not None:
+            self.stats.emit("decide", index=index, core=self.waveform[index].selected_core)
+    
+    def backtrack(self):
+        """Undoes failed decisions and bans the core each one chose, until one WaveElement has cores left.
         
         Returns
         -------
-        bool
-            If the cull changed anything
+        int
+            The index of the WaveElement whose ban must be propogated, or -1 if the collapse should give up
         """
         
-        if not self.waveform[index].collapsed:
-            wave_selection = self.waveform[index-self.radius:index+self.radius+1]
-            return self.waveform[index].cull_patches(wave_selection)
-        return
+        while self.trail is not None and self.trail.decisions and self.backtracks < self.max_backtracks:
+            self.backtracks = self.backtracks + 1
+            index, core, restored = self.trail.undo(self.waveform)
+            self.decisions.pop()
+            if self.stats is not None:
+                self.stats.emit("backtrack", index=index, core=core)
+            for i in restored:
+                if not self.waveform[i].collapsed:
+                    self.update_priority(i)
+            self.save(index)
+            self.waveform[index].ban_core(core)
+            if len(self.waveform[index].possible_cores) > 0:
+                self.update_priority(index)
+                return index
+        return -1
     
-    def empty_propogate(self):
-        """Scans over the wave and culls WaveElements based on their neighbors.
-        """
-        
-        max_cycles = 1
-        for cycle in range(max_cycles):
-            changed = False
-            for i in range(self.max_size):
-                j = self.radius + i
-                changed = changed or self.cull_at(j)
-            for i in range(self.max_size):
-                j = self.radius + self.max_size - i -1
-                changed = changed or self.cull_at(j)
-            if not changed:
-                break
-    def propogate_from(self, index):
-        """Scans over the surroundings of a WaveElement and culls its neighbors, then the whole wave.
+    def propogate(self, indices):
+        """Culls the neighbors of changed WaveElements until no WaveElement changes.
+        
+        Each changed WaveElement is queued once, and only the slot of the sub-string
+        covering it is re-checked in each of its neighbors.
         
         Parameters
         ----------
-        index : int
-            The index of the WaveElement to cull around
+        indices : list <int>
+            The indices of the WaveElements that changed
+        
+        Returns
+        -------
+        bool
+            False if a WaveElement was left with no possible cores
         """
+        
+        stats = self.stats
+        if stats is not None:
+            stats.count("propogate")
         l = len(self.waveform)
+        queue = deque(indices)
+        queued = set(indices)
+        while queue:
+            j = queue.popleft()
+            queued.discard(j)
+            allowed_cores = set(self.waveform[j].possible_cores)
+            if len(allowed_cores) == 0:
+                if stats is not None:
+                    stats.contradiction(j)
+                return False
+            for d in range(1, self.radius+1):
+                for i, slot in ((j - d, self.radius + d), (j + d, self.radius - d)):
+                    if i < 0 or i >= l or self.waveform[i].collapsed:
+                        continue
+                    if stats is not None:
+                        stats.count("cull_at")
+                    self.save(i)
+                    if self.waveform[i].cull_slot(slot, allowed_cores, self.patch_index, stats):
+                        self.update_priority(i)
+                        if i not in queued:
+                            queue.append(i)
+                            queued.add(i)
+        return True
+    
+    def pin(self, pins):
+        """Restricts WaveElements to single cores before collapsing, then propogates.
         
+        Used to carry the cores decided by a failed Wave of a higher radius over to this one. 
+        Unlike constraints, pins are not part of the template.
         
-        for i in range(self.radius):
-            right_index = index + i + 1
-            left_index = index - i - 1
-            if right_index - self.radius >= 0 and right_index + self.radius < l:
-                self.cull_at(right_index)
-            if left_index - self.radius >= 0 and left_index + self.radius < l:
-                self.cull_at(left_index)
+        Parameters
+        ----------
+        pins : dict {<int> : int}
+            The core of each pinned position, 0 being the first position after the start
+        
+        Returns
+        -------
+        bool
+            False if a WaveElement was left with no possible cores
+        """
+        
+        changed = []
+        for position, core in pins.items():
+            i = self.radius + position
+            if i < self.radius or i >= self.radius + self.max_size:
+                continue
+            self.pins[position] = core
+            we = self.waveform[i]
+            if we.collapsed:
+                continue
+            for c in list(we.possible_cores):
+                if c != core:
+                    we.ban_core(c)
+            self.update_priority(i)
+            changed.append(i)
+        return self.propogate(changed)
+    
+    def kept_cores(self):
+        """Finds the cores pinned or decided further than radius from every WaveElement with no possible cores.
+        
+        Used after a failed collapse, to carry the cores away from the contradiction over to a Wave of a lower radius.
+        
+        Returns
+        -------
+        dict {<int> : int}
+            The core of each position, 0 being the first position after the start
+        """
+        
+        failed = [i for i, we in enumerate(self.waveform) if len(we.possible_cores) == 0]
+        decided = [(self.radius + position, core) for position, core in self.pins.items()] + self.decisions
+        return {i - self.radius : core for i, core in decided if all(abs(i - j) > self.radius for j in failed)}
+    
+    def remove_patches(self, removed):
+        """Removes Patches from every WaveElement, then culls their neighbors until no WaveElement changes.
+        
+        Used on the clone of a template when Patches are removed from the model, which gives the 
+        same super-position as compiling the template again without them.
         
-        self.empty_propogate()
+        Parameters
+        ----------
+        removed : int
+            The bitset of the Patches to remove
+        
+        Returns
+        -------
+        bool
+            False if a WaveElement was left with no possible cores
+        """
         
+        changed = []
+        for i, we in enumerate(self.waveform):
+            lost = we.live & removed
+            if lost:
+                we.remove_ids(lost)
+                changed.append(i)
+        return self.propogate(changed)
+    
+    def propogate_from(self, index):
+        """Culls outward from a changed WaveElement until no WaveElement changes.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the WaveElement to cull around
+        
+        Returns
+        -------
+        bool
+            False if a WaveElement was left with no possible cores
+        """
+        
+        return self.propogate([index])
         
     def check_fully_collapsed(self):
         """Check if every element of the wave is collapsed.
@@ -189,14 +489,27 @@ class Wave:
             If the collapse was successful
         """
         
-        i = self.seed_collapse()
-        self.propogate_from(i)
+        if self.check_failed_collapse():
+            return False
         
-        
-        while not (self.check_fully_collapsed() or self.check_failed_collapse()):
-            self.empty_propogate()
-            if self.check_failed_collapse():
-                break
-            self.propogate_from(self.do_best_collapse())
-        self.empty_propogate()
-        return not self.check_failed_collapse()
\ No newline at end of file
+        stats = self.stats
+        if stats is not None:
+            start = stats.clock()
+        i = self.seed_collapse()
+        while i >= 0:
+            consistent = self.propogate_from(i)
+            if stats is not None:
+                start = stats.lap("propogate", start)
+            if not consistent:
+                self.learn(i)
+            if consistent:
+                i = self.do_best_collapse()
+                if stats is not None:
+                    start = stats.lap("select", start)
+            else:
+                i = self.backtrack()
+                if stats is not None:
+                    start = stats.lap("backtrack", start)
+                if i < 0:
+                    return False
+        return self.check_fully_collapsed() and not self.check_failed_collapse()
\ No newline at end of file
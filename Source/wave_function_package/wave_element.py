@@ -1,16 +1,30 @@
 import random
 import math
 from wave_function_package import Patch
+from wave_function_package import PatchIndex
 
 class WaveElement:
     """Represents a single location in the wave function as a super-position of Patches.
     
+    The Patches in super-position are kept as a bitset of their identifiers in a PatchIndex 
+    shared by every WaveElement of a model.
+    
     Attributes
     ----------
+    index : PatchIndex
+        The index of every Patch, which gives each Patch its bit
+    live : int
+        The bitset of the Patches still possible
     normalization : int
         Weighted number of Patches still possible
+    core_weights : dict {<int> : int}
+        Weighted number of Patches still possible for each core
+    core_weight_logs : dict {<int> : float}
+        Sum of w*log(w) over the Patches still possible for each core
+    sum_weight_log : float
+        Running sum of w*log(w) over every Patch still possible, used for shannon entropy
     patches : dict {<int> : list <Patch>}
-        The dictionary of Patches in super-position, indexed by Patch.core
+        The Patches in super-position, indexed by Patch.core, built from live when read
     possible_cores : list <int>
         List of cores that are still possible
     collapsed : bool
@@ -19,21 +33,52 @@ class WaveElement:
         If the WaveElement has collapsed, this is the core of the remaining Patches
         """
     
-    def __init__(self, all_patches = []):
+    __slots__ = ("index", "live", "normalization", "core_weights", "core_weight_logs", "sum_weight_log",
+                 "possible_cores", "collapsed", "selected_core")
+    
+    def __init__(self, all_patches = [], patch_index = None):
         """
         Parameters
         ----------
         all_patches : list <Patch>
             List of all Patches to be put in super-position
+        patch_index : PatchIndex, optional
+            The index of all_patches, built here if not given
         """
         
-        self.normalization = 0
-        self.patches = {}
-        self.possible_cores = []
+        if patch_index is None and len(all_patches) > 0:
+            patch_index = PatchIndex(all_patches, all_patches[0].radius)
+        self.index = patch_index
         self.collapsed = False
         self.selected_core = -1
-        for p in all_patches:
-            self.add_patch(p)
+        if patch_index is None:
+            self.live = 0
+            self.possible_cores = []
+            self.core_weights = {}
+            self.core_weight_logs = {}
+        else:
+            self.live = patch_index.all_mask
+            self.possible_cores = list(patch_index.cores)
+            self.core_weights = dict(patch_index.core_weights)
+            self.core_weight_logs = dict(patch_index.core_weight_logs)
+        self.normalization = sum(self.core_weights.values())
+        self.sum_weight_log = sum(self.core_weight_logs.values())
+        
+    @property
+    def patches(self):
+        """Builds the dictionary of Patches in super-position, indexed by Patch.core, from live.
+        
+        Returns
+        -------
+        dict {<int> : list <Patch>}
+            The Patches still possible
+        """
+        
+        patches = {}
+        for i in self.index.iter_ids(self.live) if self.live else []:
+            p = self.index.patches_list[i]
+            patches.setdefault(p.core, []).append(p)
+        return patches
             
     def add_patch(self, patch):
         """Adds one Patch to the super-position, updating values accordingly
@@ -41,15 +86,21 @@ class WaveElement:
         Parameters
         ----------
         patch : Patch
-            A single Patch
+            A single Patch, added to the index if it is new
         """
         
         if self.collapsed:
             raise Exception("calling add_patch despite being collapsed");
-        if patch.core not in self.patches:
-            self.patches[patch.core] = []
-        self.patches[patch.core].append(patch)
-        self.normalization = self.normalization + patch.frequency
+        if self.index is None:
+            self.index = PatchIndex([], patch.radius)
+        i = self.index.ids.get(patch.raw_patch)
+        if i is None:
+            i = self.index.add_patch(patch)
+        if self.live >> i & 1:
+            return
+        self.live = self.live | (1 << i)
+        self.set_core_weight(patch.core, self.core_weights.get(patch.core, 0) + self.index.frequencies[i],
+                             self.core_weight_logs.get(patch.core, 0.0) + self.index.weight_logs[i])
         if patch.core not in self.possible_cores:
             self.possible_cores.append(patch.core)
             
@@ -64,47 +115,176 @@ class WaveElement:
         
         if self.collapsed:
             raise Exception("calling subtract_patch despite being collapsed");
-        kill_list = []
-        if patch.core in self.patches:
-            for p in self.patches[patch.core]:
-                if p.same_pattern(patch):
-                    self.normalization = self.normalization - p.frequency
-                    kill_list.append(p)
-        
-        for k in kill_list:
-            self.patches[patch.core].remove(k)
-        if len(self.patches[patch.core]) == 0:
-            self.possible_cores.remove(patch.core)
+        i = self.index.ids.get(patch.raw_patch) if self.index is not None else None
+        if i is None or not self.live >> i & 1:
+            return
+        self.remove_ids(1 << i)
+        
+    def remove_ids(self, removed):
+        """Removes a bitset of Patches from the super-position, updating values accordingly
+        
+        A core losing every one of its Patches is dropped without looking at its Patches one by one, 
+        and a core losing most of them has its weights summed from the Patches it keeps.
+        
+        Parameters
+        ----------
+        removed : int
+            The bitset of the Patches to remove, all of which are still possible
+        """
+        
+        index = self.index
+        frequencies = index.frequencies
+        weight_logs = index.weight_logs
+        live = self.live
+        for c in list(self.possible_cores):
+            mask = index.core_masks[c]
+            lost = removed & mask
+            if lost == 0:
+                continue
+            if lost == live & mask:
+                self.set_core_weight(c, 0, 0.0)
+                self.possible_cores.remove(c)
+                continue
+            kept = (live & mask) ^ lost
+            if lost.bit_count() <= kept.bit_count():
+                ids = index.iter_ids(lost)
+                self.set_core_weight(c, self.core_weights[c] - sum([frequencies[i] for i in ids]),
+                                     self.core_weight_logs[c] - sum([weight_logs[i] for i in ids]))
+            else:
+                ids = index.iter_ids(kept)
+                self.set_core_weight(c, sum([frequencies[i] for i in ids]), sum([weight_logs[i] for i in ids]))
+        self.live = live & ~removed
+            
+    def reweigh(self, changes):
+        """Updates the weights of the super-position after the frequencies of some Patches changed in the PatchIndex.
+        
+        Parameters
+        ----------
+        changes : dict {<int> : tuple (int, float)}
+            The change of frequency and of frequency*log(frequency) of each changed Patch, by identifier
+        """
+        
+        live = self.live
+        cores = self.index.patch_cores
+        for i, (frequency, weight_log) in changes.items():
+            if live >> i & 1:
+                c = cores[i]
+                self.set_core_weight(c, self.core_weights[c] + frequency, self.core_weight_logs[c] + weight_log)
+            
+    def set_core_weight(self, core, weight, weight_log):
+        """Sets the weights of the Patches possible for one core, updating the running sums.
+        
+        Parameters
+        ----------
+        core : int
+            The core whose weight changed
+        weight : int
+            The new weighted number of Patches possible for that core
+        weight_log : float
+            The new sum of w*log(w) over the Patches possible for that core
+        """
+        
+        self.normalization = self.normalization + weight - self.core_weights.get(core, 0)
+        self.sum_weight_log = self.sum_weight_log + weight_log - self.core_weight_logs.get(core, 0.0)
+        if weight > 0:
+            self.core_weights[core] = weight
+            self.core_weight_logs[core] = weight_log
+        elif core in self.core_weights:
+            del self.core_weights[core]
+            del self.core_weight_logs[core]
+            
+    def get_entropy(self):
+        """Calculates the shannon entropy of the Patches still possible, from the running sums.
+        
+        Returns
+        -------
+        float
+            The shannon entropy, or 100 if no Patches are possible
+        """
+        
+        if self.normalization <= 0:
+            return 100
+        return math.log(self.normalization) - (self.sum_weight_log / self.normalization)
             
-    def get_collapse_quality(self):
-        """Calculates the quality of the collapse of this WaveElement.
+    def get_collapse_quality(self, heuristic = "entropy"):
+        """Calculates the quality of the collapse of this WaveElement, lower is collapsed sooner.
         
-        Quality should mathematically be shannon entropy, but for a 2d 
-        wave function collapse, normalization is used for simplicity.
+        Parameters
+        ----------
+        heuristic : str, optional
+            "entropy" for the shannon entropy of the possible Patches, 
+            or "normalization" for the weighted number of possible Patches
+        
+        Returns
+        -------
+        float
+            The quality of the collapse
         """
         
         if self.collapsed:
             raise Exception("calling get_collapse_quality despite being collapsed");
-                    
-        #    Shannon Entropy
-        
-        #sum_weight = 0
-        #sum_weight_log = 0
-        #for c in self.patches:
-        #    part_sum = 0
-        #    for p in self.patches[c]:
-        #        part_sum = part_sum + p.frequency
-        #    if part_sum > 0:
-        #        sum_weight = sum_weight + part_sum
-        #        sum_weight_log = sum_weight_log + part_sum*math.log(part_sum)
-        #entropy = 100
-        #if sum_weight > 0:
-        #    entropy = math.log(sum_weight) - (sum_weight_log / sum_weight)
-        #
-        #return entropy
-        
-        
-        return self.normalization        
+        if heuristic == "entropy":
+            return self.get_entropy()
+        if heuristic == "normalization":
+            return self.normalization
+        raise Exception("Unknown collapse heuristic : " + str(heuristic))
+    
+    def get_state(self):
+        """Captures the super-position so it can be restored after a failed collapse.
+        
+        Returns
+        -------
+        tuple
+            The state of the WaveElement
+        """
+        
+        return (self.live, list(self.possible_cores), self.normalization, dict(self.core_weights),
+                dict(self.core_weight_logs), self.sum_weight_log, self.collapsed, self.selected_core)
+    
+    def set_state(self, state):
+        """Restores a super-position captured by get_state.
+        
+        Parameters
+        ----------
+        state : tuple
+            The state of the WaveElement
+        """
+        
+        (self.live, possible_cores, self.normalization, core_weights,
+         core_weight_logs, self.sum_weight_log, self.collapsed, self.selected_core) = state
+        self.possible_cores = list(possible_cores)
+        self.core_weights = dict(core_weights)
+        self.core_weight_logs = dict(core_weight_logs)
+    
+    def clone(self):
+        """Copies the WaveElement, sharing its PatchIndex.
+        
+        Returns
+        -------
+        WaveElement
+            The copy
+        """
+        
+        we = WaveElement()
+        we.index = self.index
+        we.set_state(self.get_state())
+        return we
+    
+    def ban_core(self, core):
+        """Removes every Patch of one core from the super-position.
+        
+        Parameters
+        ----------
+        core : int
+            The core to remove
+        """
+        
+        if self.collapsed:
+            raise Exception("calling ban_core despite being collapsed");
+        if core in self.core_weights:
+            self.live = self.live & ~self.index.core_masks[core]
+            self.possible_cores.remove(core)
+            self.set_core_weight(core, 0, 0.0)
     
     def fixed_collapse(self, core):
         """Collapses the WaveElement to the chosen core.
@@ -120,7 +300,10 @@ class WaveElement:
         self.collapsed = True
         self.selected_core = core
         self.normalization = 1
-        self.patches = {}
+        self.core_weights = {core : 1}
+        self.core_weight_logs = {core : 0.0}
+        self.sum_weight_log = 0.0
+        self.live = 0
         self.possible_cores = [self.selected_core]
         
     def max_collapse(self):
@@ -129,16 +312,15 @@ class WaveElement:
         
         if self.collapsed:
             raise Exception("calling max_collapse despite being collapsed");
-        if len(self.patches) == 0:
+        if self.live == 0:
             raise Exception("Failed max_collapse : No patches")
-        max_patch = None
+        max_id = -1
         max_freq = -1
-        for c in self.patches:
-            for p in self.patches[c]:
-                if p.frequency >= max_freq:
-                    max_patch = p
-                    max_freq = p.frequency
-        self.fixed_collapse(max_patch.core)
+        for i in self.index.iter_ids(self.live):
+            if self.index.frequencies[i] >= max_freq:
+                max_id = i
+                max_freq = self.index.frequencies[i]
+        self.fixed_collapse(self.index.patch_cores[max_id])
         
     def max_core_collapse(self):
         """Collapses the WaveElement to the core with the total highest frequency.
@@ -147,64 +329,77 @@ class WaveElement:
         if self.collapsed:
             raise Exception("calling max_core_collapse despite being collapsed");
             
-        if len(self.patches) == 0:
+        if self.live == 0:
             raise Exception("Failed max_core_collapse : No patches")
             
         max_core = -1
         max_freq = -1
-        for c in self.patches:
-            total = 0
-            for p in self.patches[c]:
-                total = total + p.frequency
-            if total >= max_freq:
+        for c in self.possible_cores:
+            if self.core_weights[c] >= max_freq:
                 max_core = c
-                max_freq = total
+                max_freq = self.core_weights[c]
         self.fixed_collapse(max_core)
         
-    def probable_collapse(self):
+    def probable_collapse(self, rng = random, excluded = ()):
         """Collapses the WaveElement via probability, weighted to each Patch by its frequency.
+        
+        Parameters
+        ----------
+        rng : random.Random, optional
+            The source of randomness, the global random module if not given
+        excluded : set <int>, optional
+            Possible cores not to collapse to, which must leave at least one
         """
         
         if self.collapsed:
             raise Exception("calling probable_collapse despite being collapsed");
             
-        countdown = random.randint(0,self.normalization)
-        for c in self.patches:
-            for p in self.patches[c]:
-                countdown = countdown - p.frequency
-                if countdown <= 0:
-                    self.fixed_collapse(p.core)
-                    return
+        normalization = self.normalization
+        for c in excluded:
+            normalization = normalization - self.core_weights[c]
+        countdown = rng.randint(0,normalization)
+        for c in self.possible_cores:
+            if c in excluded:
+                continue
+            countdown = countdown - self.core_weights[c]
+            if countdown <= 0:
+                self.fixed_collapse(c)
+                return
         raise Exception("Failed probable_collapse : Countdown did not end")
         
-    def cull_patches(self, surroundings):
-        """Removes Patches from the super-position based on surroundings.
-        
+    def cull_slot(self, slot, allowed_cores, patch_index, stats = None):
+        """Removes Patches that need a core outside of allowed_cores at one slot of their sub-string.
+
         Parameters
         ----------
-        surroundings : list <WaveElement>
-            The possible wave surrounding this WaveElement.
-        
+        slot : int
+            The position within the sub-string that the changed neighbor covers
+        allowed_cores : set <int>
+            The cores still possible at that neighbor
+        patch_index : PatchIndex
+            The compatibility index of the model
+        stats : CollapseStats, optional
+            Where to count the Patches checked and removed
+
         Returns
         -------
         bool
             If this culling changed the super-position.
         """
-        
+
         if self.collapsed:
-            raise Exception("calling cull_patches despite being collapsed");
-            
-        change = False
-        for c in self.patches:
-            kill_patches = []
-            for p in self.patches[c]:
-                if not p.match_surroundings(surroundings):
-                    kill_patches.append(p)
-            for p in kill_patches:
-                change = True
-                self.subtract_patch(p)
-        return change
-    
+            raise Exception("calling cull_slot despite being collapsed");
+
+        if stats is not None:
+            stats.count("match_surroundings", self.live.bit_count())
+        removed = self.live & patch_index.removed_at(slot, allowed_cores)
+        if removed == 0:
+            return False
+        if stats is not None:
+            stats.count("patches_removed", removed.bit_count())
+        self.remove_ids(removed)
+        return True
+
     def check_collapse(self):
         """Test if this WaveElement is collapse, or if it should be, and collapse if so.
         
@@ -221,4 +416,4 @@ class WaveElement:
             return True
         return False
             
-        
\ No newline at end of file
+        
@@ -0,0 +1,452 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import json
+import logging
+import multiprocessing
+import random
+import time
+import urllib.parse
+from wave_function_package import CollapseStats
+from text_wave_handler import TextWaveHandler, _init_worker, _produce_chunk
+from tokenizer import ByteTokenizer
+
+def _copy_handler(handler):
+    """Copies a handler for one thread worker, sharing the model but not the caches changed by producing.
+
+    The templates, infeasible lengths and automaton tables are copied, so that what one thread
+    compiles is not seen half built by the others, and so are the fallback models.
+
+    Parameters
+    ----------
+    handler : TextWaveHandler
+
+    Returns
+    -------
+    TextWaveHandler
+        The copy
+    """
+
+    worker = copy.copy(handler)
+    worker.wave = None
+    worker.templates = dict(handler.templates)
+    worker.infeasible_lengths = set(handler.infeasible_lengths)
+    worker.batch_waves = {}
+    worker.nogoods = {}
+    if handler.automaton is not None:
+        worker.automaton = copy.copy(handler.automaton)
+        worker.automaton.tables = dict(handler.automaton.tables)
+    worker.fallbacks = [_copy_handler(fallback) for fallback in handler.fallbacks]
+    return worker
+
+def _produce_copy(worker, task):
+    """Produces one chunk of strings in a thread, with a copy of the handler owned by that thread.
+
+    Parameters
+    ----------
+    worker : TextWaveHandler
+        The copy of the handler
+    task : tuple (int, int, int)
+        The number of strings to produce, the maximum number of attempts and the seed of the chunk
+
+    Returns
+    -------
+    tuple (list <ProductionResult>, dict)
+        Each string produced, and the exported stats of the chunk if the handler is instrumented
+    """
+
+    n, max_out, seed = task
+    worker.rng = random.Random(seed)
+    worker.batch_waves = {}
+    worker.nogoods = {}
+    if worker.stats is not None:
+        worker.stats = CollapseStats()
+    results = worker.produce_batch(n, max_out)
+    return results, worker.stats.to_dict() if worker.stats is not None else None
+
+class WaveService:
+    """Serves strings of one model from a buffer kept full by background workers.
+
+    Every worker produces chunks of strings, in a thread or a process, and puts them in a bounded
+    buffer, waiting while it is full. Requests take strings from the buffer, so their latency does
+    not depend on how many attempts each string needed. When the buffer is empty, requests wait for
+    the workers, and once max_waiting requests are waiting the next ones are refused.
+
+    Attributes
+    ----------
+    handler : TextWaveHandler
+        The handler with the model to produce from
+    buffer_size : int
+        The number of strings kept ready
+    workers : int
+        The number of threads or processes producing strings
+    processes : bool
+        If the workers are processes instead of threads
+    chunk_size : int
+        The number of strings produced by each task of a worker
+    max_out : int
+        The maximum number of attempts for each chunk
+    max_waiting : int
+        The number of requests that may wait on an empty buffer
+    seed : int
+        The master seed of the chunks, random if None
+    buffer : asyncio.Queue
+        The strings ready to serve, created by start
+    waiting : int
+        The number of requests waiting on the buffer
+    counters : dict {<str> : int}
+        The number of strings produced and served, of chunks that maxed out or failed, and of requests refused or waiting on an empty buffer
+    latencies : collections.deque <float>
+        The seconds taken by the latest requests
+    """
+
+    def __init__(self, handler, buffer_size = 256, workers = 1, processes = False, chunk_size = 16, max_out = 2000,
+                 max_waiting = 64, seed = None, latency_window = 1000):
+        """
+        Parameters
+        ----------
+        handler : TextWaveHandler
+        buffer_size : int, optional
+        workers : int, optional
+        processes : bool, optional
+        chunk_size : int, optional
+        max_out : int, optional
+        max_waiting : int, optional
+        seed : int, optional
+        latency_window : int, optional
+            The number of requests kept in latencies
+        """
+
+        self.handler = handler
+        self.buffer_size = buffer_size
+        self.workers = workers
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.max_out = max_out
+        self.max_waiting = max_waiting
+        self.seed = seed
+        self.buffer = None
+        self.waiting = 0
+        self.counters = {"produced" : 0, "served" : 0, "maxed_out" : 0, "refused" : 0, "waited" : 0, "errors" : 0}
+        self.latencies = collections.deque(maxlen=latency_window)
+        self._master = random.Random(seed)
+        self._executor = None
+        self._tasks = []
+
+    async def start(self):
+        """Starts the workers, which begin filling the buffer.
+        """
+
+        #Compile the templates before the workers start, so that they all share them
+        self.handler.compile_templates()
+        self.buffer = asyncio.Queue(self.buffer_size)
+        if self.processes:
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            else:
+                context = multiprocessing.get_context()
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, context, _init_worker, (self.handler,))
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self._tasks = [asyncio.ensure_future(self._fill(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers, dropping the strings still in the buffer.
+        """
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _fill(self, index):
+        """Produces chunks of strings in one worker for as long as the service runs.
+
+        Parameters
+        ----------
+        index : int
+            The position of the worker
+        """
+
+        loop = asyncio.get_running_loop()
+        produce = _produce_chunk if self.processes else self._make_copy()
+        while True:
+            task = (self.chunk_size, self.max_out, self._master.getrandbits(64))
+            try:
+                results, stats = await loop.run_in_executor(self._executor, produce, task)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                #Keep the worker alive, with a fresh copy of the handler in case the failure left it broken
+                logging.getLogger(__name__).exception("Worker %d failed to produce a chunk", index)
+                self.counters["errors"] = self.counters["errors"] + 1
+                if not self.processes:
+                    produce = self._make_copy()
+                await asyncio.sleep(0.1)
+                continue
+            if stats is not None and self.handler.stats is not None:
+                self.handler.stats.merge(stats)
+            for result in results:
+                if result.maxed_out:
+                    self.counters["maxed_out"] = self.counters["maxed_out"] + 1
+                    continue
+                await self.buffer.put(result)
+                self.counters["produced"] = self.counters["produced"] + 1
+
+    def _make_copy(self):
+        """Copies the handler for one thread worker with _copy_handler.
+
+        Returns
+        -------
+        function
+            Produces one task of the worker with the copy
+        """
+
+        worker = _copy_handler(self.handler)
+        return lambda task: _produce_copy(worker, task)
+
+    async def get(self, timeout = None):
+        """Takes one string from the buffer, waiting for the workers if it is empty.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The longest time to wait, or None to wait until a string is ready
+
+        Returns
+        -------
+        ProductionResult
+            The string, with the attempts and time its production took
+        """
+
+        return (await self.get_many(1, timeout))[0]
+
+    async def get_many(self, n, timeout = None):
+        """Takes n strings from the buffer, waiting for the workers if it runs out.
+
+        Parameters
+        ----------
+        n : int
+            The number of strings, at most buffer_size
+        timeout : float, optional
+            The longest time to wait for all of them, or None to wait until they are ready
+
+        Returns
+        -------
+        list <ProductionResult>
+            The strings, with the attempts and time their production took
+        """
+
+        if self.buffer is None:
+            raise Exception("The service has not been started")
+        if n > self.buffer_size:
+            raise ValueError("Cannot take more than " + str(self.buffer_size) + " strings at once")
+        start = time.perf_counter()
+        out = []
+        while len(out) < n and not self.buffer.empty():
+            out.append(self.buffer.get_nowait())
+        if len(out) < n:
+            if self.waiting >= self.max_waiting:
+                self._give_back(out)
+                self.counters["refused"] = self.counters["refused"] + 1
+                raise Exception("Too many requests are waiting for strings")
+            self.waiting = self.waiting + 1
+            self.counters["waited"] = self.counters["waited"] + 1
+            taken = False
+            try:
+                await asyncio.wait_for(self._take(out, n), timeout)
+                taken = True
+            finally:
+                self.waiting = self.waiting - 1
+                if not taken:
+                    #Timed out or cancelled, so the strings taken so far go back to other requests
+                    self._give_back(out)
+        self.counters["served"] = self.counters["served"] + n
+        self.latencies.append(time.perf_counter() - start)
+        return out
+
+    async def _take(self, out, n):
+        """Waits for strings from the buffer until out holds n of them.
+
+        Each string is added to out as soon as it is taken, so that the caller still has them if this is cancelled.
+
+        Parameters
+        ----------
+        out : list <ProductionResult>
+            The strings taken so far, added to in place
+        n : int
+            The number of strings out should hold
+        """
+
+        while len(out) < n:
+            out.append(await self.buffer.get())
+
+    def _give_back(self, results):
+        """Puts strings taken by a request that was not served back in the buffer.
+
+        Strings that do not fit because the workers filled the buffer meanwhile are put back as soon as there is room.
+
+        Parameters
+        ----------
+        results : list <ProductionResult>
+        """
+
+        for result in results:
+            try:
+                self.buffer.put_nowait(result)
+            except asyncio.QueueFull:
+                self._tasks = [task for task in self._tasks if not task.done()]
+                self._tasks.append(asyncio.ensure_future(self.buffer.put(result)))
+
+    def percentile(self, q):
+        """Finds a percentile of the latency of the latest requests.
+
+        Parameters
+        ----------
+        q : float
+            The percentile, from 0 to 100
+
+        Returns
+        -------
+        float
+            The latency in seconds, 0 if no request was served
+        """
+
+        if len(self.latencies) == 0:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q/100*len(ordered)))]
+
+    def status(self):
+        """Exports the state of the buffer, the counters and the latencies.
+
+        Returns
+        -------
+        dict
+            The status, which can be dumped to JSON
+        """
+
+        out = {"buffered" : self.buffer.qsize() if self.buffer is not None else 0, "buffer_size" : self.buffer_size,
+               "waiting" : self.waiting, "workers" : self.workers, "processes" : self.processes}
+        out.update(self.counters)
+        out["p50_ms"] = 1000*self.percentile(50)
+        out["p99_ms"] = 1000*self.percentile(99)
+        if self.handler.stats is not None:
+            out["stats"] = self.handler.stats.to_dict()
+        return out
+
+    async def handle(self, reader, writer):
+        """Answers one HTTP request on a connection.
+
+        GET /generate?n=<count>&timeout=<seconds> answers with the strings as JSON, 400 if n is not a
+        number or more than buffer_size, or 503 if too many requests are waiting or the timeout ran out,
+        and GET /status answers with the status.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+        writer : asyncio.StreamWriter
+        """
+
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                code, body = 405, {"error" : "Only GET is supported"}
+            else:
+                url = urllib.parse.urlsplit(parts[1])
+                query = urllib.parse.parse_qs(url.query)
+                if url.path == "/status":
+                    code, body = 200, self.status()
+                elif url.path == "/generate":
+                    try:
+                        n = int(query.get("n", ["1"])[0])
+                        timeout = float(query["timeout"][0]) if "timeout" in query else None
+                        results = await self.get_many(n, timeout)
+                        code, body = 200, {"strings" : [r.text for r in results]}
+                    except asyncio.TimeoutError:
+                        code, body = 503, {"error" : "No strings were ready in time"}
+                    except ValueError as e:
+                        code, body = 400, {"error" : str(e)}
+                    except Exception as e:
+                        code, body = 503, {"error" : str(e)}
+                else:
+                    code, body = 404, {"error" : "Unknown path " + url.path}
+            data = json.dumps(body).encode("utf-8")
+            reason = {200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 503 : "Service Unavailable"}[code]
+            writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                          % (code, reason, len(data))).encode("latin-1") + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host = "127.0.0.1", port = 8080, path = None):
+        """Starts the workers and serves HTTP requests until cancelled.
+
+        Parameters
+        ----------
+        host : str, optional
+            The address to listen on
+        port : int, optional
+            The port to listen on
+        path : str, optional
+            A Unix socket to listen on instead of host and port
+        """
+
+        async with self:
+            if path is not None:
+                server = await asyncio.start_unix_server(self.handle, path)
+            else:
+                server = await asyncio.start_server(self.handle, host, port)
+            async with server:
+                await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves strings of one model over HTTP from a pre-warmed buffer.")
+    parser.add_argument("source", help="a compiled model file, or a text file with --text")
+    parser.add_argument("--text", action="store_true", help="read the source as text instead of a compiled model")
+    parser.add_argument("--bytes", action="store_true", help="use a ByteTokenizer")
+    parser.add_argument("--radius", type=int, default=2)
+    parser.add_argument("--max-size", type=int, default=16)
+    parser.add_argument("--variable-length", action="store_true")
+    parser.add_argument("--engine", default="wave")
+    parser.add_argument("--buffer", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--processes", action="store_true", help="produce in processes instead of threads")
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--max-waiting", type=int, default=64)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", help="a Unix socket to listen on instead of host and port")
+    args = parser.parse_args()
+
+    wh = TextWaveHandler(max_size=args.max_size, radius=args.radius, variable_length=args.variable_length,
+                         engine=args.engine, tokenizer=ByteTokenizer() if args.bytes else None)
+    if args.text:
+        wh.read_file(args.source)
+    else:
+        wh.load_model(args.source)
+    service = WaveService(wh, args.buffer, args.workers, args.processes, args.chunk_size,
+                          max_waiting=args.max_waiting, seed=args.seed)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()